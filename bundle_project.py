@@ -2,8 +2,19 @@
 # !/usr/env/bin python3
 # -*- coding: utf-8 -*-
 
-# Version: 1.3.2 # Updated version to reflect dotfile handling fix
-# Modified: 2025-06-28 # Date of dotfile logic correction
+# Version: 1.14.0 # Generated, minified and lock file detection
+# Modified: 2026-10-19
+# Change: Added GENERATED_FILES: lock/minified/generated files (detected from the first block) are summarized or skipped.
+# Change: Added NOTEBOOK_EXTRACT / NOTEBOOK_OUTPUT_LINES: .ipynb files are reduced to cell sources (outputs dropped).
+# Change: Added CHUNK_EXPORT_FILENAME / CHUNK_CACHE_FILENAME: JSONL chunks split at function/class boundaries.
+# Change: Added SCAN_WORKERS: directories are listed by a thread pool (same output order) for high-latency mounts.
+# Change: ROOT_DIR may be a .zip/.tar(.gz/.bz2/.xz) archive; included members are streamed, excluded ones never read.
+# Change: Added OUTPUT_PROFILES: one scan feeds several named profiles (own rules and mode); shared files are read once.
+# Change: Added SCAN_CACHE_FILENAME: SQLite directory-scan cache revalidated by directory mtimes.
+# Change: Added DATA_SUMMARY_* options: large CSV/JSON files are summarized (sample rows / streamed skeleton).
+# Change: Added ADD_BUNDLE_INDEX (byte-offset index footer) with list_bundle_files()/extract_bundle_file() readers.
+# Change: Replaced the Path lists of the scan with a compact ScanStore; unused lists are no longer collected.
+# Change: Added DELTA_BASE / MANIFEST_FILENAME for changed-files-only bundles (manifest or git revision).
 # Change: Corrected the logic for dotfile handling in INCLUDE_EXTENSIONS and EXCLUDE_EXTENSIONS.
 # Change: Added INCLUDE_FULL_STRUCTURE_TREE option to control full structure output.
 # Change: Added script execution directory path to the output header.
@@ -26,6 +37,30 @@ Supports different output modes:
 Allows optional inclusion of the full (unfiltered) structure tree.
 Outputs the script's execution directory path in the header.
 Optionally processes .gitignore at the project root to extend exclusion rules.
+Optionally writes a manifest (size/mtime/hash) of bundled files and can emit a
+delta bundle containing only files added, modified or deleted since a previous
+manifest or a git revision.
+Optionally appends a machine-readable index (byte offset, length, hash and
+encoding of each file) so single files can be extracted without parsing the
+whole bundle (see list_bundle_files() / extract_bundle_file()).
+Large CSV/JSON data files are replaced by a bounded summary (column types and
+sample rows, or a streamed structure skeleton).
+Jupyter notebooks are stream-parsed and reduced to their cell sources with cell
+markers; outputs and embedded binary payloads are dropped (text outputs can
+optionally be kept, truncated).
+Lock files, minified files and generated code (detected from the first block of
+each file) are replaced by a one-line summary or skipped.
+Optionally keeps a persistent directory-scan cache so that unchanged
+directories (same mtime) are not listed again on the next run.
+Directories are listed by a pool of worker threads, so scans of network
+mounts are not bound by one round trip per directory.
+Optionally exports the bundled code as JSONL chunks split at function/class
+boundaries (ast for Python, bracket heuristics for TS/JS/CSS) for retrieval
+indexes; chunk boundaries of unchanged files are reused from a cache.
+Several named output profiles (each with its own rules and output mode) can
+be generated from a single scan; files shared between profiles are read once.
+The root can also be a .zip or .tar archive: the same rules are applied to
+member paths and only included members are read, without extracting to disk.
 
 The output starts with a very prominent separator and explanation, followed by:
 - The content specified by the selected OUTPUT_MODE and configuration.
@@ -37,11 +72,32 @@ Uses a two-stage filtering logic after initial exclusion checks:
 
 import os
 import io
+import re
+import ast
+import csv
+import json
+import mmap
+import time
+import itertools
+import contextlib
+import hashlib
+import tarfile
+import zipfile
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 import sys
-from typing import List, Dict, Any, Optional, Tuple, Union, Set
+from typing import List, Dict, Any, Optional, Tuple, Union, Set, Iterable, Iterator, Callable, BinaryIO, TextIO
+from array import array
 import datetime  # Added for timestamping
 
+try:
+    import sqlite3  # Only needed for SCAN_CACHE_FILENAME
+except ImportError:  # Some minimal Python builds ship without sqlite3
+    sqlite3 = None
+
 # ==============================================================================
 # 用户配置区域 - 请在此处修改参数
 # ==============================================================================
@@ -49,6 +105,10 @@ import datetime  # Added for timestamping
 
 # 1. 根目录 (Root Directory)
 #    项目文件的根目录绝对路径。留空 ("") 或 None 则使用脚本所在目录。
+#    也可以是 .zip 或 .tar (.tar.gz/.tgz/.tar.bz2/.tar.xz) 归档文件: 直接读取归档, 不解压到磁盘,
+#    筛选规则作用于归档内的成员路径 (此时 MANIFEST_FILENAME / DELTA_BASE / SCAN_CACHE_FILENAME 不生效)。
+#    如果所有成员都在同一个顶层目录中 (如 GitHub 下载的 "project-main/"), 该目录会被去掉,
+#    路径和规则 (INCLUDE_SUBDIRS, .gitignore 等) 与解压后的项目目录一致。
 #    Windows 示例: r"C:\Users\YourName\ProjectFolder"
 ROOT_DIR: Optional[str] = ""
 
@@ -80,6 +140,9 @@ INCLUDE_FULL_STRUCTURE_TREE: bool = True
 # 1. **硬编码排除 (强制最高优先级)**:
 #    - 文件名是否为脚本自身名称?
 #    - 文件名是否与原始 OUTPUT_FILENAME 配置匹配? (防止覆盖自身)
+#    - 文件名是否与 MANIFEST_FILENAME 配置匹配? (如果启用了文件清单)
+#    - 文件名是否与 SCAN_CACHE_FILENAME 配置匹配? (如果启用了扫描缓存)
+#    - 文件名是否与 CHUNK_EXPORT_FILENAME / CHUNK_CACHE_FILENAME 配置匹配? (如果启用了分块导出)
 #    - 如果 **是** -> 文件被 **立即强制排除**，处理结束。
 #    - 如果 **否** -> 进入步骤 2。
 #
@@ -203,11 +266,147 @@ OUTPUT_HEADER_EXPLANATION: str = """
 #
 # Please use this content as a reference for understanding the project.
 #
-# Script Version: 1.3.2
+# Script Version: 1.14.0
 # Generation Time: {generation_time}
 # ==============================================================================
 """
 
+# --- 增量捆绑 (Delta Bundle, 用于 Mode 1) ---
+
+# 16. 文件清单 (Bundle Manifest)
+#      如果设置 (e.g., "bundle_manifest.json"), Mode 1 运行结束后会在脚本目录下写入一个 JSON 清单,
+#      记录每个被包含文件的 大小 / 修改时间 / SHA-256 哈希, 供后续的增量捆绑使用。
+#      可以包含目录部分 (e.g., "manifests/bundle_manifest.json", 相对路径基于脚本目录, 目录须已存在)。
+#      留空 ("") 或 None 则不写入清单。该文件名会被硬编码排除, 不会被捆绑。
+MANIFEST_FILENAME: Optional[str] = ""
+
+# 17. 增量基准 (Delta Base)
+#      留空 ("") 或 None: 正常生成完整捆绑包。
+#      设置后, Mode 1 只输出自基准以来 新增 / 修改 / 删除 的文件, 并用一个小型的变更树代替完整结构树。
+#      - 清单路径 (e.g., "bundle_manifest.json", 相对路径基于脚本目录): 与之前写入的清单比较。
+#        大小和修改时间都未变的文件不会被重新读取; 否则通过哈希判断内容是否真的改变。
+#      - "git:<revision>" (e.g., "git:HEAD", "git:main~3"): 与本地 git 仓库中的该修订版比较。
+#      删除的文件只在变更树中列出 (标记为 [deleted])。
+DELTA_BASE: Optional[str] = ""
+
+# --- 捆绑包索引 (Bundle Index, 用于 Mode 1) ---
+
+# 18. 添加捆绑包索引 (Add Bundle Index)
+#      True: 在捆绑包末尾追加一个机器可读的索引, 记录每个文件内容的 字节偏移 / 长度 / SHA-256 / 编码。
+#      读取方可以用 mmap 直接跳转到任意文件, 而无需扫描 "--- File:" 分隔符;
+#      参见本脚本中的 list_bundle_files() 和 extract_bundle_file() 函数。
+#      启用时输出文件总是使用 '\n' 换行 (不做平台换行转换), 以保证偏移准确。
+ADD_BUNDLE_INDEX: bool = False
+
+# --- 数据文件摘要 (Data File Summaries, 用于 Mode 1) ---
+
+# 19. 数据文件摘要阈值 (Data Summary Threshold, 字节)
+#      大于该大小的 .csv / .tsv / .json 文件不再完整内联, 而是输出一个有大小上限的摘要:
+#      - CSV/TSV: 列名和推断类型、前 N 行样本, 以及通过快速换行扫描得到的行数。
+#      - JSON: 通过流式解析生成的结构骨架 (数组/对象只保留前几项, 长字符串被截断)。
+#      设置为 0 或 None 则禁用 (始终完整内联)。
+DATA_SUMMARY_THRESHOLD_BYTES: Optional[int] = 100 * 1024
+
+# 20. CSV 样本行数 (Data Summary Sample Rows)
+#      CSV/TSV 摘要中保留的数据行数 (不含表头)。
+DATA_SUMMARY_SAMPLE_ROWS: int = 20
+
+# 21. JSON 数组样本数 (Data Summary Sample Items)
+#      JSON 骨架中每个数组保留的元素个数 (对象至少保留 25 个键)。
+DATA_SUMMARY_SAMPLE_ITEMS: int = 3
+
+# --- 目录扫描缓存 (Scan Cache, 用于所有模式) ---
+
+# 22. 扫描缓存文件名 (Scan Cache Filename)
+#      如果设置 (e.g., ".bundle_scan_cache.sqlite"), 在脚本目录下维护一个 SQLite 扫描索引,
+#      保存每个目录的条目列表和修改时间。下次运行时, mtime 未变的目录直接取自缓存,
+#      只有 mtime 改变的目录会被重新列出 (对基本不变的仓库, Mode 2 / Mode 3 几乎瞬间完成)。
+#      缓存只影响目录遍历; Mode 1 仍然每次读取文件内容。留空 ("") 或 None 则禁用。
+#      该文件名会被硬编码排除。
+SCAN_CACHE_FILENAME: Optional[str] = ""
+
+# --- 多输出配置 (Output Profiles) ---
+
+# 23. 输出配置列表 (Output Profiles)
+#      留空 ([]) 时按上面的全局设置生成一个输出 (默认行为)。
+#      每个配置 (profile) 是一个字典, 必须包含唯一的 "name" (只能包含字母、数字、'-' 和 '_'),
+#      并可覆盖以下设置 (未指定的项使用上面的全局值):
+#        "output_mode", "include_full_structure_tree", "add_summary_header",
+#        "exclude_dirs", "exclude_files", "exclude_extensions",
+#        "include_files", "include_subdirs", "include_extensions"
+#      所有配置共享同一次目录扫描; 被多个配置包含的文件内容只读取一次。
+#      输出文件名 (以及 MANIFEST_FILENAME 和作为 DELTA_BASE 的清单文件名) 中会加入配置名称,
+#      如 "gemini_project_bundle_python_20250421230925.txt"。其他设置 (索引、数据摘要等) 对所有配置相同。
+#      最多 32 个配置。示例 (参考 src/utils/presets.ts 中的预设):
+#        {"name": "python", "output_mode": 1, "include_extensions": [".py", ".toml", ".md", "requirements.txt"]},
+#        {"name": "frontend", "output_mode": 1, "include_subdirs": ["src"], "include_extensions": [".ts", ".tsx", ".css"]},
+#        {"name": "structure", "output_mode": 3},
+OUTPUT_PROFILES: List[Dict[str, Any]] = [
+
+]
+
+# --- 并行扫描 (Parallel Scan) ---
+
+# 24. 扫描线程数 (Scan Workers)
+#      用于列出目录 (scandir) 的线程数。在网络文件系统 (NFS/SMB 等高延迟挂载) 上,
+#      多个目录会被同时列出, 扫描时间随线程数缩短, 而不是 "目录数 × 往返延迟"。
+#      输出内容和顺序与单线程扫描完全相同。0 或 1 = 单线程扫描 (归档来源总是单线程)。
+SCAN_WORKERS: int = 8
+
+# --- 分块导出 (Chunked JSONL Export, 用于 Mode 1) ---
+
+# 25. 分块导出文件名 (Chunk Export Filename)
+#      如果设置 (e.g., "bundle_chunks.jsonl"), Mode 1 会在脚本目录下额外写入一个 JSONL 文件,
+#      每行一个代码块 (chunk), 按函数 / 类边界切分, 便于直接载入检索 (RAG) 索引:
+#      - Python (.py/.pyi): 使用 ast 解析, 每个顶层函数 / 类一个块 (过大的类按方法切分)。
+#      - TS/JS (.ts/.tsx/.js/.jsx/...) 和 CSS (.css/.scss/.less): 按括号深度和缩进的启发式规则切分。
+#      - 其他文件 (或无法解析的文件) 按 CHUNK_MAX_LINES 行切分。
+#      每条记录包含 path, start_line, end_line (从 1 开始, 包含), kind, name, language,
+#      sha256 (块内容哈希), file_sha256 和 content。留空 ("") 或 None 则不导出。
+#      多输出配置时文件名中会加入配置名称。该文件名会被硬编码排除。
+CHUNK_EXPORT_FILENAME: Optional[str] = ""
+
+# 26. 分块缓存文件名 (Chunk Cache Filename)
+#      如果设置 (e.g., ".bundle_chunk_cache.json"), 在脚本目录下保存每个文件的分块边界,
+#      以文件内容哈希为键: 内容未变的文件直接复用上次的分块, 不再重新解析。
+#      留空 ("") 或 None 则每次都重新分块。该文件名会被硬编码排除。
+CHUNK_CACHE_FILENAME: Optional[str] = ""
+
+# 27. 每块最大行数 (Chunk Max Lines)
+#      超过此行数的函数 / 类会被继续切分 (类按方法切分, 其余按行数切分);
+#      相邻的零散语句 (import、常量等) 和 CSS 规则会被合并, 直到达到此行数。
+CHUNK_MAX_LINES: int = 120
+
+# --- Jupyter 笔记本 (Notebooks, 用于 Mode 1) ---
+
+# 28. 提取笔记本单元 (Notebook Extract)
+#      True (默认): .ipynb 文件不再以原始 JSON 内联, 而是流式解析后只输出单元源代码,
+#      每个单元前加上标记行 (如 "# %% [code] cell 3 (In [2])", "# %% [markdown] cell 4")。
+#      单元输出 (包括 base64 图片等二进制数据) 默认被丢弃。无法解析时回退为原始内容。
+#      False: 按普通文本文件完整内联。
+NOTEBOOK_EXTRACT: bool = True
+
+# 29. 笔记本输出行数 (Notebook Output Lines)
+#      0 (默认): 丢弃所有单元输出。
+#      N > 0: 保留文本输出 (stdout/stderr、text/plain 结果和错误回溯), 每个输出截断到 N 行;
+#      图片、HTML 等富媒体数据只保留类型和大小说明。
+NOTEBOOK_OUTPUT_LINES: int = 0
+
+# --- 生成文件检测 (Generated Files, 用于 Mode 1) ---
+
+# 30. 生成文件处理 (Generated Files)
+#      只根据文件开头的一块内容 (前 8 KiB) 识别生成的文件, 不需要额外读取整个文件:
+#      - 锁文件 (package-lock.json, yarn.lock, pnpm-lock.yaml, poetry.lock, Cargo.lock 等, 按文件名识别)。
+#      - 压缩 (minified) 的 JS/CSS 等: 平均行长度很长, 或文件名包含 ".min."。
+#      - source map, 以及开头注释中带有 "@generated" / "DO NOT EDIT" / "auto-generated" 等标记的文件
+#        (如 protobuf / OpenAPI 生成的代码)。
+#      可选值:
+#      - "summary" (默认): 用一行摘要代替文件内容 (文件名、大小; 锁文件还包括依赖包数量,
+#        只统计前 4 MiB, 更大的锁文件显示为 "≥N")。
+#      - "skip": 不输出这些文件 (它们仍会出现在结构树中)。
+#      - "off" (或 "" / None): 不检测, 按普通文件完整内联。
+GENERATED_FILES: Optional[str] = "summary"
+
 # ==============================================================================
 # 配置结束 - 下面是脚本逻辑
 # ==============================================================================
@@ -278,9 +477,11 @@ def is_file_excluded(relative_path: Path, config: ConfigDict, script_name: str)
     """
     # --- 强制硬编码排除 (最高优先级) ---
     # 排除脚本自身和潜在的原始输出文件 (防止读取自身或意外覆盖)
+    # 以及脚本生成的辅助文件 (文件清单、扫描缓存)
     original_output_filename = config.get('orig_output_filename')
     if relative_path.name == script_name or \
-            (original_output_filename and relative_path.name == original_output_filename):
+            (original_output_filename and relative_path.name == original_output_filename) or \
+            relative_path.name in config.get('generated_filenames', ()):
         # print(f"DEBUG: Hardcoded exclusion for {relative_path.as_posix()}") # 可选的调试输出
         return True
 
@@ -418,40 +619,6 @@ def _build_tree_recursive(tree: FileTree, parts: Tuple[str, ...], is_file: bool)
         _build_tree_recursive(current_level, remaining_parts, is_file)
 
 
-def build_tree_from_paths(paths: List[Path], root_dir: Path) -> FileTree:
-    """根据文件和目录路径列表构建嵌套字典表示的文件树。"""
-    tree: FileTree = {}
-    processed_dirs: Set[Path] = set()
-
-    # Sort paths to ensure parent directories are processed before children, generally
-    # This helps in correctly creating nested structures.
-    sorted_paths = sorted(paths, key=lambda p: p.parts)
-
-    for relative_path in sorted_paths:
-        if not relative_path.parts: continue  # Skip empty path (e.g., Path('.'))
-
-        full_path = root_dir / relative_path
-        is_file_flag = False  # Default to dir unless known to be file
-        if full_path.exists():  # Check disk only if necessary
-            is_file_flag = full_path.is_file()
-        elif relative_path.suffix:  # Heuristic: if it has a suffix, assume it was a file
-            is_file_flag = True
-
-        # Add parent directories implicitly if not already added
-        parent = relative_path.parent
-        while parent != Path('.') and parent not in processed_dirs:
-            if parent.parts:  # Avoid adding '.' itself via this loop
-                _build_tree_recursive(tree, parent.parts, is_file=False)
-            processed_dirs.add(parent)
-            parent = parent.parent
-        if parent == Path('.') and parent not in processed_dirs:  # Process root's direct children's parent
-            processed_dirs.add(parent)  # Mark root as processed
-
-        _build_tree_recursive(tree, relative_path.parts, is_file=is_file_flag)
-
-    return tree
-
-
 def format_tree_node(name: str, node: Optional[FileTree], prefix: str, is_last: bool) -> List[str]:
     """递归地格式化树的一个节点（文件或目录）。"""
     lines: List[str] = []
@@ -489,17 +656,527 @@ def generate_tree_string(title: str, tree: FileTree, root_display: str = ".") ->
     return "\n".join(lines) + "\n"
 
 
+# --- 紧凑扫描存储 (Compact Scan Store) ---
+
+class ScanStore:
+    """
+    紧凑的扫描结果存储, 用于替代每个条目一个 Path 对象的列表 (百万级条目时可节省大量内存)。
+    每个条目只保存 (父目录 id, 名称) 以及类型标记和两个输出配置位掩码, 存放在按列组织的 array 中;
+    名称经过 sys.intern 去重, 目录前缀通过父目录 id 共享。id 0 为根目录本身。
+    位掩码的第 i 位对应第 i 个输出配置 (profile): visible = 未被该配置的 EXCLUDE_DIRS 排除,
+    included = 通过了该配置的筛选规则 (Mode 1 和 2)。
+    """
+    __slots__ = ('parents', 'names', 'flags', 'visible', 'included')
+
+    FLAG_DIR = 1
+    ROOT_ID = 0
+    MAX_PROFILES = 32  # Width of the 'I' mask columns
+
+    def __init__(self, all_profiles_mask: int = 1):
+        self.parents = array('l', [-1])
+        self.names: List[str] = ['']
+        self.flags = array('B', [self.FLAG_DIR])
+        self.visible = array('I', [all_profiles_mask])
+        self.included = array('I', [0])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, parent_id: int, name: str, flags: int, visible: int, included: int = 0) -> int:
+        """添加一个条目, 返回其 id。"""
+        self.parents.append(parent_id)
+        self.names.append(sys.intern(name))
+        self.flags.append(flags)
+        self.visible.append(visible)
+        self.included.append(included)
+        return len(self.names) - 1
+
+    def is_dir(self, entry_id: int) -> bool:
+        return bool(self.flags[entry_id] & self.FLAG_DIR)
+
+    def path_parts(self, entry_id: int) -> Tuple[str, ...]:
+        """返回条目相对于根目录的路径组成部分。"""
+        parts: List[str] = []
+        while entry_id > self.ROOT_ID:
+            parts.append(self.names[entry_id])
+            entry_id = self.parents[entry_id]
+        return tuple(reversed(parts))
+
+    def relative_path(self, entry_id: int) -> Path:
+        """按需生成条目的相对路径 (不会被保存)。"""
+        return Path(*self.path_parts(entry_id))
+
+    def sort_key(self, entry_id: int) -> Tuple[str, ...]:
+        """路径排序键, 与对 Path 列表排序的顺序一致 (Windows 路径比较不区分大小写)。"""
+        parts = self.path_parts(entry_id)
+        return tuple(part.lower() for part in parts) if os.name == 'nt' else parts
+
+    def included_ids(self, profile_bit: int = 1) -> List[int]:
+        """返回被指定配置包含的文件 id, 按路径排序 (见 sort_key())。"""
+        return sorted((i for i in range(1, len(self.names)) if self.included[i] & profile_bit),
+                      key=self.sort_key)
+
+    def build_tree(self, entry_ids: Optional[Iterable[int]] = None, profile_bit: int = 1) -> FileTree:
+        """
+        构建嵌套字典文件树。entry_ids 为 None 时包含该配置可见的所有条目, 否则只包含给定条目及其祖先目录。
+        类型取自存储的标记, 无需再访问磁盘。
+        """
+        tree: FileTree = {}
+        dir_nodes: Dict[int, FileTree] = {self.ROOT_ID: tree}
+
+        def dir_node(dir_id: int) -> FileTree:
+            node = dir_nodes.get(dir_id)
+            if node is None:
+                parent_node = dir_node(self.parents[dir_id])
+                node = parent_node.setdefault(self.names[dir_id], {})
+                dir_nodes[dir_id] = node
+            return node
+
+        if entry_ids is None:
+            entry_ids = (i for i in range(1, len(self.names)) if self.visible[i] & profile_bit)
+        for entry_id in entry_ids:
+            if self.is_dir(entry_id):
+                dir_node(entry_id)
+            else:
+                dir_node(self.parents[entry_id])[self.names[entry_id]] = None
+        return tree
+
+
+# Directory entry kinds returned by list_directory()
+ENTRY_FILE = 0
+ENTRY_DIR = 1
+ENTRY_DIR_SYMLINK = 2  # Listed like a directory but not descended into (os.walk followlinks=False)
+
+DirListing = List[Tuple[str, int]]
+
+
+def list_directory(dir_path: Path) -> DirListing:
+    """列出目录条目, 返回按名称排序的 (名称, 类型) 列表。无法访问时抛出 OSError。"""
+    listing: DirListing = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            try:
+                entry_is_dir = entry.is_dir()
+            except OSError:
+                entry_is_dir = False
+            if not entry_is_dir:
+                listing.append((entry.name, ENTRY_FILE))
+            else:
+                listing.append((entry.name, ENTRY_DIR_SYMLINK if entry.is_symlink() else ENTRY_DIR))
+    listing.sort()
+    return listing
+
+
+class ScanCache:
+    """
+    持久化的目录扫描缓存 (SQLite), 保存每个目录的条目列表和修改时间 (mtime)。
+    目录 mtime 未变时直接使用缓存的条目, 只重新列出 mtime 改变的目录。
+    注意: 文件内容或大小的变化不会改变目录 mtime, 因此缓存只用于目录结构 (文件名/类型)。
+    """
+    # Directories modified this recently are not cached (mtime granularity could hide a change)
+    RACY_WINDOW_NS = 2 * 1000 ** 3
+
+    def __init__(self, cache_path: Path, root_dir: Path):
+        self.cache_path = cache_path
+        self.root_key = root_dir.as_posix()
+        self.hits = 0
+        self.misses = 0
+        self._seen: Set[str] = set()
+        self._scan_start_ns = time.time_ns()
+        # Rows are queried per directory and updates written straight away (committed by save()), so no
+        # listings are held in memory. list_directory() is called from the scan worker threads.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(cache_path), check_same_thread=False)
+        try:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS dirs (root TEXT NOT NULL, path TEXT NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, entries BLOB NOT NULL, PRIMARY KEY (root, path))")
+        except sqlite3.Error:
+            self._connection.close()
+            raise
+
+    @staticmethod
+    def _encode(listing: DirListing) -> bytes:
+        return "\0".join(f"{kind}{name}" for name, kind in listing).encode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def _decode(data: bytes) -> DirListing:
+        if not data:
+            return []
+        return [(item[1:], int(item[0])) for item in data.decode('utf-8', 'surrogateescape').split("\0")]
+
+    def list_directory(self, dir_path: Path, relative_dir_posix: str) -> DirListing:
+        """与 list_directory() 相同, 但目录 mtime 未变时使用缓存。"""
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        with self._lock:
+            self._seen.add(relative_dir_posix)
+            try:
+                cached = self._connection.execute(
+                    "SELECT entries FROM dirs WHERE root = ? AND path = ? AND mtime_ns = ?",
+                    (self.root_key, relative_dir_posix, mtime_ns)).fetchone()
+            except sqlite3.Error:
+                cached = None  # Treated as a miss; save() reports persistent database errors
+            if cached is not None:
+                self.hits += 1
+                return self._decode(cached[0])
+
+        listing = list_directory(dir_path)
+        with self._lock:
+            self.misses += 1
+            if mtime_ns < self._scan_start_ns - self.RACY_WINDOW_NS:
+                with contextlib.suppress(sqlite3.Error):
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO dirs (root, path, mtime_ns, entries) VALUES (?, ?, ?, ?)",
+                        (self.root_key, relative_dir_posix, mtime_ns, self._encode(listing)))
+        return listing
+
+    def save(self):
+        """提交改变的目录, 删除本次扫描中未访问到的目录 (已删除或已被排除), 然后关闭缓存。"""
+        try:
+            with self._connection:
+                self._connection.execute("CREATE TEMP TABLE seen (path TEXT PRIMARY KEY)")
+                self._connection.executemany("INSERT INTO seen (path) VALUES (?)",
+                                             ((path,) for path in self._seen))
+                self._connection.execute(
+                    "DELETE FROM dirs WHERE root = ? AND path NOT IN (SELECT path FROM seen)", (self.root_key,))
+        finally:
+            self._connection.close()
+
+
+class FileSystemSource:
+    """磁盘上的项目目录 (默认来源)。scan_cache: (可选) 目录扫描缓存, mtime 未变的目录不会被重新列出。"""
+    is_archive = False
+
+    def __init__(self, root_dir: Path, scan_cache: Optional[ScanCache] = None):
+        self.root_dir = root_dir
+        self.scan_cache = scan_cache
+
+    def list_directory(self, relative_dir_posix: str) -> DirListing:
+        dir_path = self.root_dir / relative_dir_posix if relative_dir_posix else self.root_dir
+        if self.scan_cache is not None:
+            return self.scan_cache.list_directory(dir_path, relative_dir_posix)
+        return list_directory(dir_path)
+
+    def is_file(self, relative_path: Path) -> bool:
+        return (self.root_dir / relative_path).is_file()
+
+    def file_size(self, relative_path: Path) -> int:
+        return os.stat(self.root_dir / relative_path).st_size
+
+    def open_binary(self, relative_path: Path) -> BinaryIO:
+        return open(self.root_dir / relative_path, 'rb')
+
+    def describe(self, relative_path: Path) -> Path:
+        """用于消息的完整路径。"""
+        return self.root_dir / relative_path
+
+    def prefetch(self, relative_paths: Iterable[Path]):
+        pass  # Files on disk can be read in any order
+
+    def close(self):
+        pass
+
+
+class ArchiveSource:
+    """
+    .zip 或 .tar (.tar.gz/.tgz/.tar.bz2/.tar.xz) 归档作为项目来源, 不解压到磁盘。
+    扫描只使用成员列表 (zip 中央目录 / tar 头), 成员内容只在文件被包含时才以流的方式读取。
+    目录结构由成员路径推出; tar 中的符号链接和特殊文件会被忽略。
+    所有成员都位于同一个顶层目录中时 (如 GitHub 下载的 "repo-main/..."), 该目录被视为项目根目录。
+    """
+    is_archive = True
+    # Included tar members up to this size are read ahead in archive order (see prefetch())
+    PREFETCH_MAX_MEMBER_BYTES = 8 * 1024 * 1024
+    # At most this many bytes are held by one read-ahead window
+    PREFETCH_MAX_WINDOW_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, archive_path: Path):
+        self.root_dir = archive_path
+        self._dirs: Dict[str, Dict[str, int]] = {'': {}}  # Directory posix path -> {name: kind}
+        self._members: Dict[str, Union[zipfile.ZipInfo, tarfile.TarInfo]] = {}
+        self._prefetched: Dict[str, bytes] = {}
+        self._prefetch_order: Dict[str, int] = {}  # Member path -> position in the read order
+        self._prefetch_paths: List[str] = []
+        self._prefetch_next = 0  # First position not yet read ahead
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._tar: Optional[tarfile.TarFile] = None
+        members: List[Tuple[List[str], Union[zipfile.ZipInfo, tarfile.TarInfo], bool]] = []
+        if zipfile.is_zipfile(archive_path):
+            self._zip = zipfile.ZipFile(archive_path)
+            for zip_info in self._zip.infolist():
+                members.append((self._member_parts(zip_info.filename), zip_info, zip_info.is_dir()))
+        else:
+            self._tar = tarfile.open(archive_path, 'r:*')
+            for tar_info in self._tar:
+                if tar_info.isdir() or tar_info.isfile():
+                    members.append((self._member_parts(tar_info.name), tar_info, tar_info.isdir()))
+        # Paths escaping the archive root are not part of the project
+        members = [member for member in members if member[0] and '..' not in member[0]]
+
+        # A single top-level directory holding everything (e.g. "project-main/") is the project root
+        self.wrapper_dir = ''
+        top_names = {parts[0] for parts, _, _ in members}
+        if len(top_names) == 1 and all(len(parts) > 1 or is_dir for parts, _, is_dir in members):
+            self.wrapper_dir = top_names.pop()
+        strip = 1 if self.wrapper_dir else 0
+        for parts, info, is_dir in members:
+            if parts[strip:]:
+                self._add_member(parts[strip:], info, is_dir)
+
+    @staticmethod
+    def _member_parts(member_name: str) -> List[str]:
+        return [part for part in member_name.replace('\\', '/').split('/') if part and part != '.']
+
+    def _add_member(self, parts: List[str], info: Union[zipfile.ZipInfo, tarfile.TarInfo], is_dir: bool):
+        dir_depth = len(parts) if is_dir else len(parts) - 1
+        for depth in range(dir_depth):
+            self._dirs['/'.join(parts[:depth])].setdefault(parts[depth], ENTRY_DIR)
+            self._dirs.setdefault('/'.join(parts[:depth + 1]), {})
+        if not is_dir:
+            self._dirs['/'.join(parts[:-1])].setdefault(parts[-1], ENTRY_FILE)
+            self._members['/'.join(parts)] = info
+
+    def list_directory(self, relative_dir_posix: str) -> DirListing:
+        entries = self._dirs.get(relative_dir_posix)
+        if entries is None:
+            raise FileNotFoundError(f"No such directory in archive: {relative_dir_posix}")
+        return sorted(entries.items())
+
+    def is_file(self, relative_path: Path) -> bool:
+        return relative_path.as_posix() in self._members
+
+    def _member(self, relative_path: Path) -> Union[zipfile.ZipInfo, tarfile.TarInfo]:
+        info = self._members.get(relative_path.as_posix())
+        if info is None:
+            raise FileNotFoundError(f"No such file in archive: {relative_path.as_posix()}")
+        return info
+
+    def file_size(self, relative_path: Path) -> int:
+        info = self._member(relative_path)
+        return info.file_size if self._zip is not None else info.size
+
+    def open_binary(self, relative_path: Path) -> BinaryIO:
+        if self._tar is not None and relative_path.as_posix() not in self._prefetched:
+            self._prefetch_window(relative_path.as_posix())
+        data = self._prefetched.pop(relative_path.as_posix(), None)
+        if data is not None:
+            return io.BytesIO(data)
+        info = self._member(relative_path)
+        if self._zip is not None:
+            return self._zip.open(info)
+        member_file = self._tar.extractfile(info)
+        if member_file is None:
+            raise OSError(f"Archive member is not a regular file: {relative_path.as_posix()}")
+        return member_file
+
+    def describe(self, relative_path: Path) -> Path:
+        """用于消息的路径 (归档路径 + 成员路径)。"""
+        return self.root_dir / self.wrapper_dir / relative_path
+
+    def prefetch(self, relative_paths: Iterable[Path]):
+        """
+        记录将要 (按此顺序) 完整读取的 tar 成员, 以便按归档中的顺序分批预读。压缩的 tar 只能顺序解压,
+        按路径顺序随机读取会导致反复从头解压; zip 成员可以直接定位, 不需要预读。
+        """
+        if self._tar is None:
+            return
+        self._prefetched.clear()
+        self._prefetch_order = {}
+        for path in relative_paths:
+            posix = path.as_posix()
+            info = self._members.get(posix)
+            if info is not None and info.size <= self.PREFETCH_MAX_MEMBER_BYTES:
+                self._prefetch_order.setdefault(posix, len(self._prefetch_order))
+        self._prefetch_paths = list(self._prefetch_order)
+        self._prefetch_next = 0
+
+    def _prefetch_window(self, posix: str):
+        """
+        从 posix 开始, 按读取顺序取总大小不超过 PREFETCH_MAX_WINDOW_BYTES 的成员, 按归档顺序读入内存。
+        上一个窗口中未被读取的内容被释放, 因此内存占用不超过一个窗口。
+        """
+        start = self._prefetch_order.get(posix)
+        if start is None or start < self._prefetch_next:
+            return  # Not read ahead, or already read once (read again directly)
+        self._prefetched.clear()
+        window: List[Tuple[str, tarfile.TarInfo]] = []
+        window_bytes = 0
+        end = start
+        while end < len(self._prefetch_paths):
+            info = self._members[self._prefetch_paths[end]]
+            if window and window_bytes + info.size > self.PREFETCH_MAX_WINDOW_BYTES:
+                break
+            window.append((self._prefetch_paths[end], info))
+            window_bytes += info.size
+            end += 1
+        self._prefetch_next = end
+        for member_posix, info in sorted(window, key=lambda member: member[1].offset_data):
+            try:
+                member_file = self._tar.extractfile(info)
+                if member_file is not None:
+                    self._prefetched[member_posix] = member_file.read()
+            except (OSError, tarfile.TarError):
+                pass  # Read (and reported) again when the file is written
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+
+ProjectSource = Union[FileSystemSource, ArchiveSource]
+# Errors raised while reading archive members (besides OSError)
+ARCHIVE_READ_ERRORS = (zipfile.BadZipFile, tarfile.TarError)
+
+
+def open_project_source(root_path: Path, scan_cache: Optional[ScanCache] = None) -> Optional[ProjectSource]:
+    """根据根路径创建项目来源: 目录或 .zip/.tar 归档。都不是时返回 None。"""
+    if root_path.is_dir():
+        return FileSystemSource(root_path, scan_cache)
+    if root_path.is_file() and (zipfile.is_zipfile(root_path) or tarfile.is_tarfile(root_path)):
+        return ArchiveSource(root_path)
+    return None
+
+
+def scan_project(source: ProjectSource, configs: List[ConfigDict], script_name: str,
+                 workers: int = 0) -> Tuple[ScanStore, int]:
+    """
+    遍历项目来源 (目录或归档) 一次, 为所有输出配置 (configs, 第 i 个对应位 1 << i) 将结果写入 ScanStore。
+    返回 (存储, 扫描到的条目总数)。
+    - 只有被所有配置的 EXCLUDE_DIRS 排除的目录才会被剪枝, 其余目录按配置记录可见性。
+    - 只有需要完整结构树的配置才会让所有文件被记录; 否则只记录被包含的文件 (Mode 1 和 2)。
+    - workers > 1: 目录由线程池按广度优先列出, 每个目录列出后立即提交其 (剪枝后的) 子目录;
+      所有目录列出后再按名称顺序一次性写入 ScanStore, 因此结果与单线程扫描完全相同。
+    目录总是被记录, 因为它们是被包含文件的父节点。
+    """
+    all_profiles_mask = (1 << len(configs)) - 1
+    store = ScanStore(all_profiles_mask)
+    total_scanned = 0
+    profile_bits = [(1 << i, config) for i, config in enumerate(configs)]
+    collect_all_mask = 0  # Profiles that render the full structure tree
+    collect_included_mask = 0  # Profiles that filter files (Mode 1 and 2)
+    for bit, config in profile_bits:
+        is_delta_bundle = config['output_mode'] == 1 and bool(config['delta_base'])
+        if config['output_mode'] in [1, 3] and config['include_full_structure_tree'] and not is_delta_bundle:
+            collect_all_mask |= bit  # Delta bundles replace the full tree with the changed file tree
+        if config['output_mode'] in [1, 2]:
+            collect_included_mask |= bit
+
+    # --- Listing: relative posix path -> sorted listing / profile visibility of each kept directory ---
+    listings: Dict[str, DirListing] = {}
+    dir_visibility: Dict[str, int] = {'': store.visible[ScanStore.ROOT_ID]}
+
+    def record_listing(relative_dir_posix: str, listing: DirListing) -> List[str]:
+        """保存目录列表, 返回需要继续列出的子目录 (被所有配置的 EXCLUDE_DIRS 排除的目录被剪枝)。"""
+        listings[relative_dir_posix] = listing
+        dir_visible = dir_visibility[relative_dir_posix]
+        subdirs: List[str] = []
+        for name, kind in listing:
+            if kind == ENTRY_FILE:
+                continue
+            relative_posix = f"{relative_dir_posix}/{name}" if relative_dir_posix else name
+            # --- Directory Exclusion during Walk (Based ONLY on EXCLUDE_DIRS config) ---
+            visible = dir_visible
+            for bit, config in profile_bits:
+                if visible & bit and is_dir_excluded(Path(relative_posix), config['exclude_dirs']):
+                    visible &= ~bit
+            if not visible:
+                continue  # Excluded by every profile: prune the walk here (never listed)
+            dir_visibility[relative_posix] = visible
+            if kind == ENTRY_DIR:
+                subdirs.append(relative_posix)
+        return subdirs
+
+    if workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan')
+        try:
+            in_flight = {executor.submit(source.list_directory, ''): ''}
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    relative_dir_posix = in_flight.pop(future)
+                    try:
+                        listing = future.result()
+                    except OSError as e:
+                        print(f"Warning: Cannot access path {e.filename}: {e}", file=sys.stderr)
+                        continue
+                    for subdir_posix in record_listing(relative_dir_posix, listing):
+                        in_flight[executor.submit(source.list_directory, subdir_posix)] = subdir_posix
+        finally:
+            executor.shutdown(cancel_futures=True)
+    else:
+        to_list = ['']
+        while to_list:
+            relative_dir_posix = to_list.pop()
+            try:
+                listing = source.list_directory(relative_dir_posix)
+            except OSError as e:
+                print(f"Warning: Cannot access path {e.filename}: {e}", file=sys.stderr)
+                continue
+            to_list.extend(record_listing(relative_dir_posix, listing))
+
+    # --- Store: depth-first in name order, so ids do not depend on which listing finished first ---
+    # Stack of (directory id, relative posix path)
+    pending: List[Tuple[int, str]] = [(ScanStore.ROOT_ID, '')]
+    while pending:
+        dir_id, relative_dir_posix = pending.pop()
+        listing = listings.pop(relative_dir_posix, None)
+        if listing is None:
+            continue  # Could not be listed (reported above)
+        dir_visible = store.visible[dir_id]
+        subdirs: List[Tuple[int, str]] = []
+        for name, kind in listing:
+            relative_posix = f"{relative_dir_posix}/{name}" if relative_dir_posix else name
+
+            if kind != ENTRY_FILE:
+                visible = dir_visibility.get(relative_posix, 0)
+                if not visible:
+                    continue  # Pruned while listing
+                total_scanned += 1
+                sub_id = store.add(dir_id, name, ScanStore.FLAG_DIR, visible)
+                if kind == ENTRY_DIR:
+                    subdirs.append((sub_id, relative_posix))
+                continue
+
+            # --- File Processing ---
+            total_scanned += 1
+            included = 0
+            if dir_visible & collect_included_mask:
+                relative_path = Path(relative_posix)
+                for bit, config in profile_bits:
+                    if (dir_visible & collect_included_mask & bit and
+                            not is_file_excluded(relative_path, config, script_name) and
+                            passes_inclusion_rules(relative_path, config)):
+                        included |= bit
+            if included or dir_visible & collect_all_mask:
+                store.add(dir_id, name, 0, dir_visible, included)
+
+        # Reverse so that the stack pops subdirectories in name order
+        pending.extend(reversed(subdirs))
+
+    return store, total_scanned
+
+
 # --- 摘要头函数 (Used only in Mode 1) ---
 
 def create_summary_header(root_dir: Path, config: ConfigDict) -> str:
     """生成输出内容的摘要头 (放在文件树之后)。"""
+    # Show dynamic hardcoded names
+    hardcoded_names = [Path(__file__).name, config.get('orig_output_filename', 'N/A')]
+    hardcoded_names.extend(sorted(config.get('generated_filenames', ())))
     header_lines = [
         "# Bundle Configuration Summary:",
         f"# Root Directory: {root_dir.as_posix()}",
+    ]
+    if config.get('profile_name'):
+        header_lines.append(f"# Output Profile: {config['profile_name']}")
+    header_lines += [
         "# Applied Filters (Exclusions first, then Inclusion Scope + Extension Filter):",
-        f"# - Hardcoded Exclusions: ['{Path(__file__).name}', '{config.get('orig_output_filename', 'N/A')}']"
-        # Show dynamic hardcoded names
+        f"# - Hardcoded Exclusions: {hardcoded_names}"
     ]
+    if config.get('delta_description'):
+        header_lines.append(f"# - Delta Bundle: only files changed since {config['delta_description']}")
     # Config Exclusions
     if config['orig_exclude_dirs']: header_lines.append(
         f"# - Config Excluded Dirs (incl. .gitignore): {config['orig_exclude_dirs']}")
@@ -523,9 +1200,15 @@ def create_summary_header(root_dir: Path, config: ConfigDict) -> str:
         header_lines.append("# - Extension Filter: None (all types included from scope)")
     else:
         header_lines.append(f"# - Extension Filter: Files must match {config['orig_include_extensions']}")
+    if config.get('generated_files'):
+        generated_action = ("content skipped" if config['generated_files'] == GENERATED_FILES_SKIP
+                            else "replaced by a one-line summary")
+        header_lines.append(f"# - Generated Files (lock files, minified files, generated code): {generated_action}")
 
     # Add note about full tree if it was potentially included
-    if config.get('include_full_structure_tree', True) and config.get('output_mode', 1) in [1, 3]:
+    if config.get('delta_description'):
+        header_lines.append("# Note: Delta bundle - only the changed file structure was listed earlier.")
+    elif config.get('include_full_structure_tree', True) and config.get('output_mode', 1) in [1, 3]:
         header_lines.append("# Note: The full project structure (respecting Excluded Dirs) was listed earlier.")
     elif not config.get('include_full_structure_tree', False) and config.get('output_mode', 1) in [1, 3]:
         header_lines.append(
@@ -535,172 +1218,1721 @@ def create_summary_header(root_dir: Path, config: ConfigDict) -> str:
     return "\n".join(header_lines) + "\n"
 
 
-# --- 主逻辑 ---
+# --- 文件内容读取 (Used only in Mode 1) ---
 
-def main():
-    """主执行函数。"""
-    # 0. Get script name and directory for hardcoded exclusion and header info
-    script_path = Path(__file__).resolve()
-    script_name = script_path.name
-    script_dir = script_path.parent
+# Encoding labels recorded in the bundle index
+ENCODING_UTF8 = "utf-8"
+ENCODING_UTF8_REPLACED = "utf-8 (invalid bytes replaced)"
+ENCODING_ERROR = "error"
+ENCODING_SUMMARY = "utf-8 (generated summary)"
+ENCODING_NOTEBOOK = "utf-8 (notebook cell sources)"
+ENCODING_SKIPPED = "skipped (generated file)"  # Not written to the bundle (GENERATED_FILES = "skip")
 
-    # 1. 解析和验证根目录
-    if not ROOT_DIR:
-        root_dir_path = script_dir
+
+def read_file_for_bundle(source: 'ProjectSource', relative_path: Path,
+                         config: Optional[ConfigDict] = None) -> Tuple[str, Optional[bytes], str]:
+    """
+    读取文件用于捆绑, 返回 (写入捆绑包的文本, 原始字节, 编码说明)。
+    原始字节用于计算清单哈希, 读取失败时为 None (文本中包含错误说明, 编码说明为 'error')。
+    启用 GENERATED_FILES 时先读取第一块内容判断是否为生成的文件; 是则不再读取其余部分。
+    """
+    file_path = source.describe(relative_path)
+    try:
+        with source.open_binary(relative_path) as infile:
+            if config and config.get('generated_files'):
+                head = infile.read(GENERATED_DETECT_BLOCK_BYTES)
+                description = detect_generated_content(relative_path.name, head)
+                if description is not None:
+                    size = len(head) if len(head) < GENERATED_DETECT_BLOCK_BYTES else source.file_size(relative_path)
+                    return generated_file_result(relative_path, size, description, config)
+                raw_data = head + infile.read()
+            else:
+                raw_data = infile.read()
+    except FileNotFoundError:
+        print(f"Warning: File not found during read (was listed but now missing?): {file_path}",
+              file=sys.stderr)
+        return f"[Error: File not found at read time: {relative_path.as_posix()}]\n", None, ENCODING_ERROR
+    except OSError as e:
+        print(f"Error: Could not read file {file_path}: {e}", file=sys.stderr)
+        return f"[Error: Could not read file {relative_path.as_posix()}: {e}]\n", None, ENCODING_ERROR
+    except Exception as e_generic:
+        print(f"Error: Unexpected error reading file {file_path}: {e_generic}", file=sys.stderr)
+        return f"[Error: Unexpected error reading file {relative_path.as_posix()}: {e_generic}]\n", None, ENCODING_ERROR
+
+    try:
+        # First try UTF-8, the most common encoding
+        text = raw_data.decode('utf-8')
+    except UnicodeDecodeError:
+        # If UTF-8 fails, use replacement characters as a fallback
+        print(f"Warning: Could not decode file as UTF-8: {file_path}. Trying with replacement.",
+              file=sys.stderr)
+        text = raw_data.decode('utf-8', errors='replace')
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return (text + "\n[Warning: File contained non-UTF-8 characters replaced during read]\n",
+                raw_data, ENCODING_UTF8_REPLACED)
+
+    # Match text-mode reads (universal newlines)
+    return text.replace('\r\n', '\n').replace('\r', '\n'), raw_data, ENCODING_UTF8
+
+
+def hash_file(file_path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """以流式方式计算文件的 SHA-256 哈希 (不一次性读入内存)。"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_file_for_bundle(source: 'ProjectSource', relative_path: Path,
+                           config: ConfigDict) -> Tuple[str, Optional[bytes], str]:
+    """
+    生成文件在捆绑包中的内容, 返回值同 read_file_for_bundle()。
+    超过阈值的数据文件 (CSV/JSON) 输出摘要而非完整内容, Jupyter 笔记本只输出单元源代码;
+    锁文件、压缩文件和生成的代码 (GENERATED_FILES) 以一行摘要代替或被跳过。
+    这些情况都不返回原始字节 (清单会单独计算哈希)。
+    """
+    suffix = relative_path.suffix.lower()
+    if suffix == NOTEBOOK_SUFFIX and config.get('notebook_extract'):
+        file_path = source.describe(relative_path)
+        try:
+            size = source.file_size(relative_path)
+            with source.open_binary(relative_path) as infile:
+                return extract_notebook(infile, size, config), None, ENCODING_NOTEBOOK
+        except ValueError as e:
+            print(f"Warning: Could not parse notebook {file_path}: {e}. Including it as raw JSON.",
+                  file=sys.stderr)
+        except (OSError,) + ARCHIVE_READ_ERRORS:
+            pass  # Fall through to read_file_for_bundle, which reports the error
+        return read_file_for_bundle(source, relative_path)
+
+    if config.get('generated_files') and relative_path.name in LOCKFILE_PACKAGE_PATTERNS:
+        # Lock files are known by name; the only read is the streamed package count
+        try:
+            size = source.file_size(relative_path)
+            if config['generated_files'] == GENERATED_FILES_SKIP:
+                return generated_file_result(relative_path, size, "lock file", config)
+            with source.open_binary(relative_path) as infile:
+                package_count, complete = count_lockfile_packages(relative_path.name, infile)
+            if package_count is None:
+                description = "lock file"
+            elif complete:
+                description = f"lock file, {package_count:,} packages"
+            else:
+                description = (f"lock file, ≥{package_count:,} packages "
+                               f"(counted in the first {LOCKFILE_COUNT_MAX_BYTES // (1024 * 1024)} MiB)")
+            return generated_file_result(relative_path, size, description, config)
+        except (OSError,) + ARCHIVE_READ_ERRORS:
+            pass  # Fall through to read_file_for_bundle, which reports the error
+
+    threshold = config.get('data_summary_threshold')
+    if threshold and suffix in DATA_SUMMARY_SUFFIXES:
+        file_path = source.describe(relative_path)
+        try:
+            size = source.file_size(relative_path)
+        except OSError:
+            size = -1  # Let read_file_for_bundle report the error
+        if size > threshold:
+            try:
+                with source.open_binary(relative_path) as infile:
+                    if suffix in CSV_SUMMARY_SUFFIXES:
+                        text = summarize_csv_file(infile, size, suffix, config)
+                    else:
+                        text = summarize_json_file(infile, size, config)
+                return text, None, ENCODING_SUMMARY
+            except (OSError, ValueError, csv.Error) + ARCHIVE_READ_ERRORS as e:
+                print(f"Warning: Could not summarize data file {file_path}: {e}. Including a head sample instead.",
+                      file=sys.stderr)
+                try:
+                    return summarize_text_head(source, relative_path, size, config, str(e)), None, ENCODING_SUMMARY
+                except (OSError,) + ARCHIVE_READ_ERRORS:
+                    pass  # Fall through to read_file_for_bundle, which reports the error
+    return read_file_for_bundle(source, relative_path, config)
+
+
+def reads_whole_file(source: 'ProjectSource', relative_path: Path, config: ConfigDict) -> bool:
+    """
+    render_file_for_bundle() 是否会完整读取该文件。笔记本、超过阈值的数据文件以及按文件名识别的
+    锁文件 / .min 文件只被流式或部分读取, 不需要预读 (见 ArchiveSource.prefetch())。
+    """
+    suffix = relative_path.suffix.lower()
+    if suffix == NOTEBOOK_SUFFIX and config.get('notebook_extract'):
+        return False
+    if config.get('generated_files') and (relative_path.name in LOCKFILE_PACKAGE_PATTERNS or
+                                          '.min.' in relative_path.name):
+        return False
+    threshold = config.get('data_summary_threshold')
+    if threshold and suffix in DATA_SUMMARY_SUFFIXES:
+        try:
+            return source.file_size(relative_path) <= threshold
+        except OSError:
+            return False
+    return True
+
+
+# --- 数据文件摘要 (Used only in Mode 1) ---
+
+CSV_SUMMARY_SUFFIXES = {'.csv', '.tsv'}
+DATA_SUMMARY_SUFFIXES = CSV_SUMMARY_SUFFIXES | {'.json'}
+DATA_SUMMARY_MAX_STRING = 80  # Characters kept from long string values / cells
+
+_JSON_TOKEN_RE = re.compile(
+    r'\s*(?:([{}\[\]:,])|("[^"\\]*(?:\\.[^"\\]*)*")|(-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?)|(true|false|null))')
+_JSON_LITERALS = {'true': True, 'false': False, 'null': None}
+# Unmatched buffer tails that may be the start of a token cut off by the end of the buffer
+_JSON_PARTIAL_TOKEN_RE = re.compile(r'\s*(?:"|-?[0-9.eE+-]*\Z|t(?:r(?:u)?)?\Z|f(?:a(?:l(?:s)?)?)?\Z|n(?:u(?:l)?)?\Z)')
+_JSON_NUMBER_TAIL_RE = re.compile(r'[0-9.eE+-]+\Z')  # A number may continue past the buffer (e.g. '1.' + '5')
+_JSON_WHITESPACE_RE = re.compile(r'\s*')
+_JSON_STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')  # Stops at the closing quote or a trailing backslash
+_JSON_BRACKET_RE = re.compile(r'[\[\]{}"]')  # Structure seen while skipping raw text (commas are counted separately)
+_JSON_SKIP_RE = re.compile(r'(?:[^\[\]{}"]+|"[^"\\]*(?:\\.[^"\\]*)*")*')  # Text and complete strings up to a bracket
+
+
+class _NewlineCountingReader(io.RawIOBase):
+    """包装二进制流, 统计经过它读取的全部内容中的换行数 (解析样本与统计行数只读一遍文件)。"""
+
+    def __init__(self, raw: BinaryIO):
+        super().__init__()
+        self._raw = raw
+        self.newlines = 0
+        self.last_byte = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._raw.read(len(buffer))
+        buffer[:len(data)] = data
+        if data:
+            self.newlines += data.count(b'\n')
+            self.last_byte = data[-1:]
+        return len(data)
+
+
+def _truncate_text(value: str, limit: int = DATA_SUMMARY_MAX_STRING) -> str:
+    if len(value) <= limit:
+        return value
+    return value[:limit] + f"...(+{len(value) - limit} chars)"
+
+
+def _infer_column_type(values: List[str]) -> str:
+    """根据样本值推断列类型 (integer / float / boolean / string / empty)。"""
+    non_empty = [v.strip() for v in values if v.strip()]
+    if not non_empty:
+        return "empty"
+    if all(v.lower() in ('true', 'false') for v in non_empty):
+        return "boolean"
+    for type_name, converter in (("integer", int), ("float", float)):
+        try:
+            for v in non_empty:
+                converter(v)
+        except ValueError:
+            continue
+        return type_name + (" (with empty values)" if len(non_empty) < len(values) else "")
+    return "string"
+
+
+def summarize_csv_file(infile: BinaryIO, size: int, suffix: str, config: ConfigDict) -> str:
+    """
+    CSV/TSV 摘要: 列名与推断类型、前 K 行样本, 以及通过快速换行扫描得到的 (近似) 行数。
+    只解析样本行; 行数统计不解码内容。文件只被顺序读取一遍 (不回退)。
+    """
+    sample_rows = config['data_summary_sample_rows']
+    counter = _NewlineCountingReader(infile)
+    buffered = io.BufferedReader(counter, 1024 * 1024)
+    text_stream = io.TextIOWrapper(buffered, encoding='utf-8', errors='replace', newline='')
+    head = text_stream.read(64 * 1024)
+    if suffix == '.tsv':
+        dialect: Any = csv.excel_tab
     else:
-        root_dir_path = Path(ROOT_DIR).resolve()
+        try:
+            dialect = csv.Sniffer().sniff(head[:8192], delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+
+    # The sample rows continue from the sniffing head (completed to a line end) into the rest of the
+    # stream, so the file is read once: compressed archive members are not decompressed again
+    head += text_stream.readline()
+    reader = csv.reader(itertools.chain(io.StringIO(head, newline=''), text_stream), dialect)
+    rows = list(itertools.islice(reader, sample_rows + 1))
+    text_stream.detach()
+    while buffered.read(1024 * 1024):
+        pass  # Newlines of the remaining bytes are counted as they pass through
+
+    total_lines = counter.newlines + (0 if counter.last_byte in (b'\n', b'') else 1)
+    data_rows = max(total_lines - 1, 0)  # Minus the header line
+
+    header = rows[0] if rows else []
+    samples = rows[1:]
+    lines = [
+        f"[Data file summary: {size:,} bytes, ~{data_rows:,} data rows (newline count, quoted line breaks "
+        f"count as rows), {len(header)} columns; showing the first {len(samples)} rows]",
+        "# Columns (types inferred from the sample rows):",
+    ]
+    for i, column in enumerate(header):
+        column_values = [row[i] for row in samples if i < len(row)]
+        lines.append(f"#   {_truncate_text(column) or f'(column {i + 1})'}: {_infer_column_type(column_values)}")
 
-    if not root_dir_path.is_dir():
-        print(f"Error: Root directory not found or is not a directory: {root_dir_path}", file=sys.stderr)
-        sys.exit(1)
+    sample_buffer = io.StringIO()
+    writer = csv.writer(sample_buffer, dialect, lineterminator='\n')
+    for row in rows:
+        writer.writerow([_truncate_text(cell) for cell in row])
+    lines.append("# Sample:")
+    return "\n".join(lines) + "\n" + sample_buffer.getvalue()
 
-    print(f"Scanning project in: {root_dir_path}")
-    print(f"Script running from: {script_dir}")  # Inform user
 
-    # <<<< MODIFICATION START: .gitignore processing >>>>
-    # 1.A. (可选) 读取并处理 .gitignore 文件
-    # 为了避免直接修改原始配置列表，我们创建副本
-    effective_exclude_dirs = EXCLUDE_DIRS[:]
-    effective_exclude_files = EXCLUDE_FILES[:]
+def iter_json_tokens(stream: TextIO, chunk_size: int = 64 * 1024,
+                     skip_next: Optional[List[Optional[str]]] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    流式 JSON 词法分析, 逐个产生 (类型, 原始文本), 类型为 'punct' / 'string' / 'number' / 'literal'。
+    缓冲区按需扩大 (超长字符串时按倍数读取), 整个文件不会被一次性读入内存。
+    skip_next: (可选) 由调用方在取下一个词之前设置的跳过模式, 跳过的内容只按括号和字符串逐块扫描,
+    不会被保存或解码:
+      'string' - 下一个词是字符串时跳过它, 产生 ('skipped_string', 原始字符数);
+      'value'  - 同上, 并且下一个值是对象/数组时整体跳过, 产生 ('skipped_value', None);
+      'rest'   - 跳过当前容器中剩余的元素直到 (不含) 其右括号, 产生 ('skipped_items', 跳过的元素数)。
+    """
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def refill() -> None:
+        nonlocal buffer, pos, eof
+        buffer = buffer[pos:]
+        pos = 0
+        data = stream.read(max(chunk_size, len(buffer)))
+        if not data:
+            eof = True
+        buffer += data
+
+    def skip_string_body() -> int:
+        """Skip a string whose opening quote was consumed; returns its raw length."""
+        nonlocal pos
+        skipped_chars = 0
+        while True:
+            end = _JSON_STRING_BODY_RE.match(buffer, pos).end()
+            if end < len(buffer) and buffer[end] == '"':
+                skipped_chars += end - pos
+                pos = end + 1
+                return skipped_chars
+            if eof:
+                raise ValueError("Invalid JSON: unterminated string")
+            # Only an unfinished escape is kept; the scanned part of the string is dropped
+            skipped_chars += end - pos
+            pos = end
+            refill()
+
+    def skip_brackets(stop_at_close: bool) -> int:
+        """
+        Skip a container value (stop_at_close=False, starts at its bracket) or the rest of the
+        current container (stop_at_close=True, stops before its closing bracket). Returns the
+        number of top-level commas passed, i.e. the number of skipped items in the latter case.
+        """
+        nonlocal pos
+        depth = 0
+        commas = 0
+        while True:
+            if depth:
+                # Inside a skipped container nothing is counted, so whole strings go in one step
+                pos = _JSON_SKIP_RE.match(buffer, pos).end()
+            match = _JSON_BRACKET_RE.search(buffer, pos)
+            if match is None:
+                if eof:
+                    raise ValueError("Invalid JSON: unexpected end of data")
+                if depth == 0:
+                    commas += buffer.count(',', pos)
+                pos = len(buffer)
+                refill()
+                continue
+            if depth == 0:
+                commas += buffer.count(',', pos, match.start())
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                skip_string_body()
+            elif char in '[{':
+                depth += 1
+            elif depth == 0:
+                pos = match.start()  # The closing bracket is left for the caller
+                return commas
+            else:
+                depth -= 1
+                if depth == 0 and not stop_at_close:
+                    return commas
+
+    while True:
+        mode = skip_next[0] if skip_next is not None else None
+        if mode:
+            pos = _JSON_WHITESPACE_RE.match(buffer, pos).end()
+            if pos == len(buffer) and not eof:
+                refill()
+                continue
+            skip_next[0] = None
+            char = buffer[pos:pos + 1]
+            if mode == 'rest':
+                yield 'skipped_items', skip_brackets(True)
+                continue
+            if char == '"':
+                pos += 1
+                yield 'skipped_string', skip_string_body()
+                continue
+            if mode == 'value' and char in ('{', '['):
+                skip_brackets(False)
+                yield 'skipped_value', None
+                continue
+        match = _JSON_TOKEN_RE.match(buffer, pos)
+        # A token touching the end of the buffer may be incomplete (e.g. a number split across chunks)
+        if match is None or (not eof and (match.end() == len(buffer) or (
+                match.group(3) and _JSON_NUMBER_TAIL_RE.match(buffer, match.end())))):
+            if eof or (match is None and not _JSON_PARTIAL_TOKEN_RE.match(buffer, pos)):
+                # Invalid characters fail at once instead of reading the rest of the file first
+                if buffer[pos:].strip():
+                    raise ValueError(f"Invalid JSON near: {buffer[pos:pos + 40]!r}")
+                return
+            refill()
+            continue
+        pos = match.end()
+        if match.group(1):
+            yield 'punct', match.group(1)
+        elif match.group(2) is not None:
+            yield 'string', match.group(2)
+        elif match.group(3):
+            yield 'number', match.group(3)
+        else:
+            yield 'literal', match.group(4)
 
-    # 使用 globals().get() 安全地检查 PROCESS_GITIGNORE 是否存在并为 True
-    if globals().get('PROCESS_GITIGNORE'):
-        gitignore_path = root_dir_path / ".gitignore"
-        if gitignore_path.is_file():
-            print(f"Found and processing: {gitignore_path}")
+
+def iter_json_events(stream: TextIO, skip_string: Optional[Callable[[str], bool]] = None,
+                     skip_request: Optional[List[Optional[str]]] = None) -> Iterator[Tuple[str, str, Any]]:
+    """
+    流式 JSON 解析, 产生 (prefix, event, value) 事件 (与 ijson.parse 的事件格式一致):
+    event 为 start_map / map_key / end_map / start_array / end_array / string / number / boolean / null,
+    prefix 为以 '.' 连接的键路径, 数组元素用 'item' 表示 (如 "cells.item.source")。
+    冒号、逗号与括号均被校验 (缺少分隔符、多余的逗号或文件截断时抛出 ValueError);
+    顶层可以有多个值 (JSON Lines / 连续的 JSON 文档)。
+    skip_string: (可选) 对 prefix 返回 True 时, 该位置的字符串值不被保存或解码,
+    而是产生 'skipped_string' 事件, 值为原始 (转义后) 字符数。
+    skip_request: (可选) 调用方在处理完一个事件后可设置的单元素列表, 作用于下一个值:
+      'value' - 跳过下一个值, 对象/数组产生 'skipped_value' 事件 (字符串为 'skipped_string');
+      'rest'  - 在一个元素之后跳过当前容器的剩余元素, 产生 'skipped_items' 事件 (值为元素数), 随后是 end 事件。
+    """
+    containers: List[List[Any]] = []  # [is_map, current_key, prefix]
+    expect = 'value'  # 'value' / 'key' / 'colon' / 'comma' (a ',' or the closing bracket) / 'close'
+    allow_close = False  # Directly after '{' or '[' (empty containers)
+    seen_value = False
+    skip_next: List[Optional[str]] = [None]
+    tokens = iter_json_tokens(stream, skip_next=skip_next)
+
+    def value_prefix() -> str:
+        if not containers:
+            return ''
+        is_map, key, base = containers[-1]
+        name = key if is_map else 'item'
+        return f"{base}.{name}" if base else name
+
+    def after_value() -> None:
+        nonlocal expect, allow_close, seen_value
+        expect = 'comma' if containers else 'value'
+        allow_close = False
+        seen_value = True
+
+    while True:
+        # Tell the tokenizer what to skip before it reads the next token
+        mode = skip_request[0] if skip_request is not None else None
+        if skip_request is not None:
+            skip_request[0] = None
+        if (mode == 'rest' and expect != 'comma') or (mode == 'value' and expect != 'value'):
+            mode = None
+        if mode is None and expect == 'value' and skip_string is not None and skip_string(value_prefix()):
+            mode = 'string'
+        skip_next[0] = mode
+
+        token = next(tokens, None)
+        if token is None:
+            if containers or expect != 'value':
+                raise ValueError("Invalid JSON: unexpected end of data")
+            if not seen_value:
+                raise ValueError("Invalid JSON: empty document")
+            return
+        kind, raw = token
+
+        if kind == 'punct':
+            if raw in '{[':
+                if expect != 'value':
+                    raise ValueError(f"Invalid JSON: unexpected '{raw}'")
+                prefix = value_prefix()
+                is_map = raw == '{'
+                yield prefix, 'start_map' if is_map else 'start_array', None
+                containers.append([is_map, None, prefix])
+                expect = 'key' if is_map else 'value'
+                allow_close = True
+            elif raw in '}]':
+                if (not containers or containers[-1][0] != (raw == '}')
+                        or not (expect in ('comma', 'close') or allow_close)):
+                    raise ValueError(f"Invalid JSON: unexpected '{raw}'")
+                is_map, _, prefix = containers.pop()
+                yield prefix, 'end_map' if is_map else 'end_array', None
+                after_value()
+            elif raw == ',':
+                if expect != 'comma':
+                    raise ValueError("Invalid JSON: unexpected ','")
+                expect = 'key' if containers[-1][0] else 'value'
+                allow_close = False
+            else:
+                if expect != 'colon':
+                    raise ValueError("Invalid JSON: unexpected ':'")
+                expect = 'value'
+            continue
+
+        if kind == 'skipped_items':
+            expect = 'close'
+            yield containers[-1][2], 'skipped_items', raw
+            continue
+        if expect == 'key':
+            if kind != 'string':
+                raise ValueError(f"Invalid JSON object key: {raw[:40]!r}")
+            key = json.loads(raw)
+            containers[-1][1] = key
+            yield containers[-1][2], 'map_key', key
+            expect = 'colon'
+            allow_close = False
+            continue
+        if expect != 'value':
+            raise ValueError(f"Invalid JSON: missing ',' or ':' before {str(raw)[:40]!r}")
+
+        if kind in ('skipped_string', 'skipped_value'):
+            yield value_prefix(), kind, raw
+        elif kind == 'string':
+            yield value_prefix(), 'string', json.loads(raw)
+        elif kind == 'number':
+            yield value_prefix(), 'number', json.loads(raw)
+        else:
+            value = _JSON_LITERALS[raw]
+            yield value_prefix(), 'null' if value is None else 'boolean', value
+        after_value()
+
+
+def build_json_skeleton(events: Iterator[Tuple[str, str, Any]], max_items: int, max_keys: int,
+                        skip_request: Optional[List[Optional[str]]] = None) -> Tuple[List[Any], int]:
+    """
+    根据解析事件构建 JSON 结构骨架: 数组只保留前 max_items 个元素, 对象只保留前 max_keys 个键,
+    长字符串被截断; 顶层值 (JSON Lines 等) 同样只保留前 max_items 个。
+    被省略的部分以 "... (+N more ...)" 标记; 传入 skip_request (与 iter_json_events 共用) 时,
+    被省略的内容由词法分析器按括号直接跳过, 否则逐个事件跳过, 两种方式都不会保存它们。
+    返回 (保留的顶层值, 顶层值总数)。
+    """
+    roots: List[Any] = []
+    root_count = 0
+    # Frames: [container, omitted_count]
+    frames: List[List[Any]] = []
+    pending_key: List[Optional[str]] = []
+    skip_depth = 0  # > 0 while skipping an omitted value event by event
+
+    def value_done() -> None:
+        """Count a finished value and ask the tokenizer to skip whatever no longer fits."""
+        nonlocal root_count
+        if not frames:
+            root_count += 1
+            if len(roots) >= max_items and skip_request is not None:
+                skip_request[0] = 'value'
+            return
+        container = frames[-1][0]
+        if len(container) >= (max_keys if isinstance(container, dict) else max_items) and skip_request is not None:
+            skip_request[0] = 'rest'
+
+    def add_value(value: Any) -> bool:
+        """Attach a value to the current container; returns False if it has to be omitted."""
+        if not frames:
+            if len(roots) >= max_items:
+                return False
+            roots.append(value)
+            return True
+        container = frames[-1][0]
+        if isinstance(container, dict):
+            if pending_key[-1] is None:
+                return False  # Value of an omitted key (already counted)
+            container[pending_key[-1]] = value
+        elif len(container) < max_items:
+            container.append(value)
+        else:
+            frames[-1][1] += 1
+            return False
+        return True
+
+    for _, event, value in events:
+        if skip_depth:
+            if event in ('start_map', 'start_array'):
+                skip_depth += 1
+            elif event in ('end_map', 'end_array'):
+                skip_depth -= 1
+                if not skip_depth:
+                    value_done()
+            continue
+
+        if event == 'map_key':
+            container = frames[-1][0]
+            if len(container) >= max_keys:
+                frames[-1][1] += 1
+                pending_key[-1] = None  # Value of an omitted key gets skipped below
+            else:
+                pending_key[-1] = value
+            continue
+        if event == 'skipped_items':
+            frames[-1][1] += value
+            continue
+
+        if event in ('start_map', 'start_array'):
+            new_container: Any = {} if event == 'start_map' else []
+            if not add_value(new_container):
+                skip_depth = 1
+                continue
+            frames.append([new_container, 0])
+            pending_key.append(None)
+            continue
+        if event in ('end_map', 'end_array'):
+            container, omitted = frames.pop()
+            pending_key.pop()
+            if omitted and isinstance(container, dict):
+                container["..."] = f"(+{omitted} more keys)"
+            elif omitted:
+                container.append(f"... (+{omitted} more items)")
+        elif event == 'skipped_string':
+            add_value(f"<string, {value:,} chars>")
+        elif event == 'skipped_value':
+            add_value("...")
+        else:
+            add_value(_truncate_text(value) if isinstance(value, str) else value)
+        value_done()
+
+    return roots, root_count
+
+
+def summarize_json_file(infile: BinaryIO, size: int, config: ConfigDict) -> str:
+    """JSON 摘要: 通过流式解析生成结构骨架 (截断数组/对象/字符串); 多个顶层值时只显示前几个。"""
+    max_items = config['data_summary_sample_items']
+    max_keys = max(max_items, 25)
+    text_stream = io.TextIOWrapper(infile, encoding='utf-8', errors='replace')
+    skip_request: List[Optional[str]] = [None]
+    roots, root_count = build_json_skeleton(iter_json_events(text_stream, skip_request=skip_request),
+                                            max_items, max_keys, skip_request)
+    header = (f"[Data file summary: {size:,} bytes; JSON structure skeleton with arrays truncated to "
+              f"{max_items} items, objects to {max_keys} keys and strings to {DATA_SUMMARY_MAX_STRING} chars")
+    if root_count == 1:
+        return header + "]\n" + json.dumps(roots[0], indent=2, ensure_ascii=False) + "\n"
+    header += f"; {root_count:,} top-level values (JSON Lines), showing the first {len(roots)}]\n"
+    body = "\n".join(json.dumps(value, indent=2, ensure_ascii=False) for value in roots)
+    more = f"\n... (+{root_count - len(roots):,} more records)" if root_count > len(roots) else ""
+    return header + body + more + "\n"
+
+
+def summarize_text_head(source: 'ProjectSource', relative_path: Path, size: int, config: ConfigDict,
+                        reason: str) -> str:
+    """无法解析的数据文件: 只输出前几行 (用于 CSV/JSON 摘要失败时的回退)。"""
+    max_lines = config['data_summary_sample_rows']
+    with source.open_binary(relative_path) as raw_file, \
+            io.TextIOWrapper(raw_file, encoding='utf-8', errors='replace') as infile:
+        head_lines = [_truncate_text(line.rstrip('\n'), 400) for line in itertools.islice(infile, max_lines)]
+    return (f"[Data file summary: {size:,} bytes; could not be parsed ({reason}), "
+            f"showing the first {len(head_lines)} lines]\n" + "\n".join(head_lines) + "\n")
+
+
+# --- Jupyter 笔记本 (Used only in Mode 1) ---
+
+NOTEBOOK_SUFFIX = '.ipynb'
+NOTEBOOK_CELL_MARKER = "# %%"  # Percent-format cell markers (as used by Jupytext / VS Code)
+_ANSI_ESCAPE_RE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+
+def _format_notebook_output(output: Dict[str, Any], max_lines: int) -> List[str]:
+    """将一个单元输出格式化为若干行: 文本截断到 max_lines 行, 图片等二进制数据只保留类型和大小。"""
+    output_type = output['output_type'] or 'output'
+    label = f"{output_type} {output['name']}" if output['name'] else output_type
+    if output_type == 'error':
+        text = '\n'.join(output['traceback']) or f"{output['ename']}: {output['evalue']}"
+        text = _ANSI_ESCAPE_RE.sub('', text)
+    elif output['text']:
+        text = ''.join(output['text'])
+    else:
+        text = ''.join(output['data'].get('text/plain', []))
+        if output['data'].get('text/plain'):
+            label += " text/plain"
+    lines = [f"# [{label}]"]
+    text_lines = text.splitlines()
+    lines.extend(_truncate_text(line, 400) for line in text_lines[:max_lines])
+    if len(text_lines) > max_lines:
+        lines.append(f"# ... (+{len(text_lines) - max_lines:,} more lines)")
+    for mime, chars in output['omitted'].items():
+        lines.append(f"# [{mime} omitted: {chars:,} chars]")
+    return lines
+
+
+def extract_notebook(infile: BinaryIO, size: int, config: ConfigDict) -> str:
+    """
+    Jupyter 笔记本 (nbformat 4): 流式解析, 只输出单元的源代码 (带单元标记)。
+    NOTEBOOK_OUTPUT_LINES > 0 时保留文本输出 (每个输出截断到 N 行); 图片等二进制数据总是被丢弃。
+    """
+    max_output_lines = config['notebook_output_lines']
+    text_stream = io.TextIOWrapper(infile, encoding='utf-8-sig', errors='replace')
+    parts: List[str] = []
+    cell_counts: Dict[str, int] = {}
+    language = ''
+    cell: Optional[Dict[str, Any]] = None
+    output: Optional[Dict[str, Any]] = None
+    data_mime = ''
+    output_prefix = 'cells.item.outputs.item'
+    data_prefix = output_prefix + '.data'
+
+    def skip_string(prefix: str) -> bool:
+        """不需要的字符串 (被丢弃的输出、图片等富媒体数据、markdown 附件) 只计数, 不保存也不解码。"""
+        if prefix.startswith('cells.item.attachments.'):
+            return True
+        if not prefix.startswith(output_prefix):
+            return False
+        if not max_output_lines:
+            return True
+        return (prefix.startswith(data_prefix + '.') and
+                prefix[len(data_prefix) + 1:] not in ('text/plain', 'text/plain.item'))
+
+    for prefix, event, value in iter_json_events(text_stream, skip_string):
+        if prefix == 'cells.item':
+            if event == 'start_map':
+                cell = {'cell_type': '', 'source': [], 'execution_count': None, 'outputs': []}
+            elif event == 'end_map' and cell is not None:
+                cell_type = cell['cell_type'] or 'code'
+                cell_counts[cell_type] = cell_counts.get(cell_type, 0) + 1
+                marker = f"{NOTEBOOK_CELL_MARKER} [{cell_type}] cell {sum(cell_counts.values())}"
+                if cell['execution_count'] is not None:
+                    marker += f" (In [{cell['execution_count']}])"
+                source = ''.join(cell['source'])
+                parts.append(marker + "\n" + source + ("\n" if source and not source.endswith("\n") else ""))
+                if cell['outputs']:
+                    parts.append("\n".join(cell['outputs']) + "\n")
+                cell = None
+            continue
+        if cell is None:
+            if event == 'string' and prefix in ('metadata.language_info.name', 'metadata.kernelspec.language'):
+                language = language or value
+            continue
+
+        if prefix in ('cells.item.source', 'cells.item.source.item') and event == 'string':
+            cell['source'].append(value)
+        elif prefix == 'cells.item.cell_type' and event == 'string':
+            cell['cell_type'] = value
+        elif prefix == 'cells.item.execution_count' and event == 'number':
+            cell['execution_count'] = value
+        elif not max_output_lines or not prefix.startswith(output_prefix):
+            continue  # Outputs are dropped: their strings are skipped by the tokenizer, never kept or decoded
+        elif prefix == output_prefix:
+            if event == 'start_map':
+                output = {'output_type': '', 'name': '', 'text': [], 'data': {}, 'omitted': {},
+                          'ename': '', 'evalue': '', 'traceback': []}
+            elif event == 'end_map' and output is not None:
+                cell['outputs'].extend(_format_notebook_output(output, max_output_lines))
+                output = None
+        elif output is None:
+            continue
+        elif prefix == data_prefix:
+            if event == 'map_key':
+                data_mime = value
+        elif prefix.startswith(data_prefix + '.'):
+            if event == 'string' and data_mime == 'text/plain':
+                output['data'].setdefault(data_mime, []).append(value)
+            elif event == 'skipped_string':
+                # Images and other rich payloads are dropped, only their size is kept
+                output['omitted'][data_mime] = output['omitted'].get(data_mime, 0) + value
+        elif event == 'string':
+            field = prefix[len(output_prefix) + 1:]
+            if field in ('output_type', 'name', 'ename', 'evalue'):
+                output[field] = value
+            elif field in ('text', 'text.item'):
+                output['text'].append(value)
+            elif field == 'traceback.item':
+                output['traceback'].append(value)
+
+    if not cell_counts:
+        raise ValueError("no nbformat 4 cells found")
+    counts = ", ".join(f"{count} {cell_type}" for cell_type, count in cell_counts.items())
+    output_note = (f"text outputs truncated to {max_output_lines} lines" if max_output_lines
+                   else "outputs omitted")
+    header = (f"[Notebook: {size:,} bytes; {sum(cell_counts.values())} cells ({counts})"
+              f"{f'; language: {language}' if language else ''}; {output_note}, binary payloads dropped]\n")
+    return header + "\n".join(parts)
+
+
+# --- 生成文件检测 (Used only in Mode 1) ---
+
+GENERATED_FILES_SUMMARY = "summary"
+GENERATED_FILES_SKIP = "skip"
+GENERATED_DETECT_BLOCK_BYTES = 8 * 1024  # Only this much of a file is looked at to detect it
+GENERATED_MIN_AVG_LINE_LENGTH = 1000  # Bytes per line in the first block that indicate minified content
+GENERATED_HEADER_LINES = 40  # Lines of the leading comment block searched for a "generated" marker
+LOCKFILE_COUNT_MAX_BYTES = 4 * 1024 * 1024  # Packages are counted in this much of a lock file ("≥N" beyond it)
+
+# Strong markers only, matched against the leading comment block: "@generated", a comment starting with
+# "DO NOT EDIT", "(Code) generated by ... DO NOT EDIT" and "This file is/was generated" (not "X is generated")
+_GENERATED_HEADER_RE = re.compile(
+    rb'@generated\b|<auto-generated\b|^\W*do not edit\b|^\W*(?:code )?generated by\b.*\bdo not edit\b'
+    rb'|^\W*this file (?:is|was|has been) (?:automatically |auto-?)?generated\b(?! by hand)', re.IGNORECASE)
+_COMMENT_PREFIXES = (b'#', b'//', b'/*', b'*', b'<!--', b'--', b';', b'"""', b"'''")
+# Comments (and module docstrings) that continue until a closing marker
+_BLOCK_COMMENT_DELIMITERS = ((b'/*', b'*/'), (b'<!--', b'-->'), (b'"""', b'"""'), (b"'''", b"'''"))
+_SOURCE_MAP_RE = re.compile(rb'^\s*\{\s*"version"\s*:\s*3\s*,')
+
+_NPM_LOCK_PATTERNS = [re.compile(rb'^\s*"node_modules/[^"]+":\s*\{', re.M), re.compile(rb'^\s*"resolved":', re.M)]
+_TOML_LOCK_PATTERNS = [re.compile(rb'^\[\[package\]\]', re.M)]
+# Lock file name -> patterns matching one line per locked package (the first pattern with matches is used)
+LOCKFILE_PACKAGE_PATTERNS: Dict[str, List['re.Pattern[bytes]']] = {
+    'package-lock.json': _NPM_LOCK_PATTERNS,
+    'npm-shrinkwrap.json': _NPM_LOCK_PATTERNS,
+    'yarn.lock': [re.compile(rb'^"?[^\s#"][^\n]*:\s*$', re.M)],
+    'pnpm-lock.yaml': [re.compile(rb"^  ['\"]?/?@?[^\s:'\"]+[@/]\d[^\s]*:\s*$", re.M)],
+    'bun.lock': [re.compile(rb'^    "[^"]+": \[', re.M)],
+    'poetry.lock': _TOML_LOCK_PATTERNS,
+    'uv.lock': _TOML_LOCK_PATTERNS,
+    'pdm.lock': _TOML_LOCK_PATTERNS,
+    'Cargo.lock': _TOML_LOCK_PATTERNS,
+    'Pipfile.lock': [re.compile(rb'^        "[^"]+": \{', re.M)],
+    'composer.lock': [re.compile(rb'^            "name":', re.M)],
+    'Gemfile.lock': [re.compile(rb'^    \S+ \(', re.M)],
+    'go.sum': [re.compile(rb'^\S+ \S+/go\.mod ', re.M)],
+    'packages.lock.json': [re.compile(rb'^\s*"resolved":', re.M)],
+    'pubspec.lock': [re.compile(rb'^  \S+:\s*$', re.M)],
+    'mix.lock': [re.compile(rb'^  "[^"]+":', re.M)],
+    'gradle.lockfile': [re.compile(rb'^[^#\s][^=\n]*=', re.M)],
+    'flake.lock': [],
+    'Podfile.lock': [],
+}
+
+
+def count_lockfile_packages(file_name: str, infile: BinaryIO, chunk_size: int = 1024 * 1024,
+                            max_bytes: int = LOCKFILE_COUNT_MAX_BYTES) -> Tuple[Optional[int], bool]:
+    """
+    流式统计锁文件中的依赖包数量 (按行匹配, 不解析、不保存内容), 最多读取前 max_bytes 字节。
+    返回 (数量, 是否读完整个文件); 未知格式时数量为 None。
+    """
+    patterns = LOCKFILE_PACKAGE_PATTERNS.get(file_name)
+    if not patterns:
+        return None, True
+    counts = [0] * len(patterns)
+    remainder = b''
+    bytes_read = 0
+    complete = True
+    while True:
+        chunk = infile.read(min(chunk_size, max_bytes - bytes_read)) if bytes_read < max_bytes else b''
+        if not chunk and bytes_read >= max_bytes and infile.read(1):
+            complete = False
+            remainder = b''  # The line cut off by the limit is not counted
+        bytes_read += len(chunk)
+        data = remainder + chunk
+        if chunk:
+            # Only count complete lines; the partial last line is kept for the next chunk
+            cut = data.rfind(b'\n') + 1
+            data, remainder = data[:cut], data[cut:]
+        for i, pattern in enumerate(patterns):
+            counts[i] += len(pattern.findall(data))
+        if not chunk:
+            break
+    return next((count for count in counts if count), 0), complete
+
+
+def detect_generated_content(file_name: str, head: bytes) -> Optional[str]:
+    """
+    根据文件开头的一块内容判断是否为生成的文件, 返回说明 (如 "source map") 或 None。
+    信号: source map 结构、开头注释块 (第一行代码之前) 中的生成标记、很长的平均行长度 (minified)、".min." 文件名。
+    """
+    if b'\0' in head:
+        return None  # Binary content is not handled here
+    if _SOURCE_MAP_RE.match(head) or (file_name.endswith('.map') and b'"mappings"' in head):
+        return "source map"
+    closing: Optional[bytes] = None  # End marker of the block comment being read
+    for line in head.split(b'\n', GENERATED_HEADER_LINES)[:GENERATED_HEADER_LINES]:
+        line = line.strip()
+        if closing is not None:
+            if closing in line:
+                closing = None
+        elif not line:
+            continue
+        elif line.startswith(_COMMENT_PREFIXES):
+            for opener, closer in _BLOCK_COMMENT_DELIMITERS:
+                if line.startswith(opener) and closer not in line[len(opener):]:
+                    closing = closer
+                    break
+        else:
+            break  # The first code line ends the leading comment block
+        if _GENERATED_HEADER_RE.search(line):
+            return f"generated-code header: {_truncate_text(line.decode('utf-8', errors='replace'))}"
+    if len(head) >= GENERATED_DETECT_BLOCK_BYTES // 2:
+        average_line_length = len(head) // (head.count(b'\n') + 1)
+        if average_line_length >= GENERATED_MIN_AVG_LINE_LENGTH:
+            return f"minified (average line length {average_line_length:,} bytes in the first {len(head):,} bytes)"
+    if '.min.' in file_name:
+        return "minified (.min file name)"
+    return None
+
+
+def generated_file_result(relative_path: Path, size: int, description: str,
+                          config: ConfigDict) -> Tuple[str, Optional[bytes], str]:
+    """生成文件在捆绑包中的内容: "skip" 时为空 (不输出), 否则为一行摘要。返回值同 read_file_for_bundle()。"""
+    if config['generated_files'] == GENERATED_FILES_SKIP:
+        return '', None, ENCODING_SKIPPED
+    return f"[Generated file summary: {relative_path.name}; {size:,} bytes; {description}]\n", None, ENCODING_SUMMARY
+
+
+# --- 文件清单与增量捆绑 (Used only in Mode 1) ---
+
+DELTA_ADDED = "added"
+DELTA_MODIFIED = "modified"
+DELTA_DELETED = "deleted"
+
+# Manifest entry: {"size": int, "mtime_ns": int, "sha256": str}
+ManifestEntries = Dict[str, Dict[str, Any]]
+
+
+def make_manifest_entry(file_path: Path, raw_data: Optional[bytes] = None) -> Dict[str, Any]:
+    """为一个文件生成清单条目。如果已经读取了原始字节则直接对其计算哈希, 避免重复读取。"""
+    stat_result = file_path.stat()
+    sha256 = hashlib.sha256(raw_data).hexdigest() if raw_data is not None else hash_file(file_path)
+    return {'size': stat_result.st_size, 'mtime_ns': stat_result.st_mtime_ns, 'sha256': sha256}
+
+
+def load_bundle_manifest(manifest_path: Path) -> ManifestEntries:
+    """读取之前写入的文件清单, 返回 {相对路径(posix): 条目}。"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    files = manifest.get('files')
+    if not isinstance(files, dict):
+        raise ValueError(f"Invalid manifest (missing 'files' mapping): {manifest_path}")
+    return files
+
+
+def write_bundle_manifest(manifest_path: Path, root_dir: Path, entries: ManifestEntries, generation_time: str):
+    """将文件清单写入磁盘 (按路径排序, 便于比较)。"""
+    manifest = {
+        'manifest_version': 1,
+        'root_directory': root_dir.as_posix(),
+        'generation_time': generation_time,
+        'files': {path: entries[path] for path in sorted(entries)},
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+        f.write("\n")
+
+
+def compute_manifest_delta(root_dir: Path, files: Iterable[Path],
+                           previous: ManifestEntries) -> Tuple[Dict[str, str], ManifestEntries]:
+    """
+    与之前的清单比较, 返回 (变更字典 {posix路径: 状态}, 未改变文件的最新清单条目)。
+    大小和修改时间都一致的文件直接视为未改变, 不读取内容; 否则比较 SHA-256。
+    """
+    changes: Dict[str, str] = {}
+    unchanged_entries: ManifestEntries = {}
+    current_paths: Set[str] = set()
+
+    for relative_path in files:
+        path_posix = relative_path.as_posix()
+        current_paths.add(path_posix)
+        previous_entry = previous.get(path_posix)
+        if previous_entry is None:
+            changes[path_posix] = DELTA_ADDED
+            continue
+        file_path = root_dir / relative_path
+        try:
+            stat_result = file_path.stat()
+            if (stat_result.st_size == previous_entry.get('size') and
+                    stat_result.st_mtime_ns == previous_entry.get('mtime_ns')):
+                unchanged_entries[path_posix] = previous_entry
+                continue
+            entry = make_manifest_entry(file_path)
+        except OSError as e:
+            print(f"Warning: Could not check file {file_path} for changes: {e}", file=sys.stderr)
+            changes[path_posix] = DELTA_MODIFIED
+            continue
+        if entry['sha256'] == previous_entry.get('sha256'):
+            unchanged_entries[path_posix] = entry  # Only touched, content identical
+        else:
+            changes[path_posix] = DELTA_MODIFIED
+
+    for path_posix in previous:
+        if path_posix in current_paths:
+            continue
+        if (root_dir / path_posix).exists():
+            continue  # Still on disk, but no longer included by the rules
+        changes[path_posix] = DELTA_DELETED
+
+    return changes, unchanged_entries
+
+
+def reuse_manifest_entries(root_dir: Path, files: Iterable[Path], changes: Dict[str, str],
+                           previous: ManifestEntries) -> ManifestEntries:
+    """
+    git 增量时复用之前清单中未改变文件的条目 (大小和修改时间都一致时), 避免为写入新清单重新读取整个项目。
+    其余文件在写入清单时再计算哈希。
+    """
+    reused: ManifestEntries = {}
+    for relative_path in files:
+        path_posix = relative_path.as_posix()
+        previous_entry = previous.get(path_posix)
+        if previous_entry is None or path_posix in changes:
+            continue
+        try:
+            stat_result = (root_dir / relative_path).stat()
+        except OSError:
+            continue  # Reported when the manifest is written
+        if (stat_result.st_size == previous_entry.get('size') and
+                stat_result.st_mtime_ns == previous_entry.get('mtime_ns')):
+            reused[path_posix] = previous_entry
+    return reused
+
+
+def run_git_command(root_dir: Path, args: List[str]) -> List[str]:
+    """在 root_dir 中运行 git 命令, 返回以 NUL 分隔的输出项 (路径相对于 root_dir)。"""
+    result = subprocess.run(['git', '-C', str(root_dir)] + args, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        message = result.stderr.decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"git {' '.join(args)} failed: {message}")
+    return [item for item in result.stdout.decode('utf-8', errors='replace').split('\0') if item]
+
+
+def compute_git_delta(root_dir: Path, revision: str, files: Iterable[Path],
+                      config: ConfigDict, script_name: str) -> Dict[str, str]:
+    """
+    与本地 git 仓库中的某个修订版比较, 返回变更字典 {posix路径: 状态}。
+    - 修订版中不存在的被包含文件 -> added
+    - git diff (工作区 vs 修订版) 中出现的被包含文件 -> modified
+    - 修订版中存在、满足当前筛选规则、但现在已不存在的文件 -> deleted
+    """
+    # Paths are relative to root_dir (git limits output to the current subdirectory)
+    revision_paths = set(run_git_command(root_dir, ['ls-tree', '-r', '--name-only', '-z', revision]))
+    diff_paths = set(run_git_command(root_dir, ['diff', '--name-only', '--relative', '-z', revision]))
+
+    changes: Dict[str, str] = {}
+    current_paths: Set[str] = set()
+    for relative_path in files:
+        path_posix = relative_path.as_posix()
+        current_paths.add(path_posix)
+        if path_posix not in revision_paths:
+            changes[path_posix] = DELTA_ADDED
+        elif path_posix in diff_paths:
+            changes[path_posix] = DELTA_MODIFIED
+
+    for path_posix in revision_paths - current_paths:
+        relative_path = Path(path_posix)
+        if (root_dir / relative_path).exists():
+            continue  # Still on disk, but no longer included by the rules
+        if not is_file_excluded(relative_path, config, script_name) and passes_inclusion_rules(relative_path, config):
+            changes[path_posix] = DELTA_DELETED
+
+    return changes
+
+
+def build_delta_tree(changes: Dict[str, str]) -> FileTree:
+    """根据变更字典构建一个小型文件树, 文件名后附加变更状态标记 (如 'app.py [modified]')。"""
+    tree: FileTree = {}
+    for path_posix in sorted(changes):
+        parts = tuple(path_posix.split('/'))
+        marked_parts = parts[:-1] + (f"{parts[-1]} [{changes[path_posix]}]",)
+        _build_tree_recursive(tree, marked_parts, is_file=True)
+    return tree
+
+
+# --- 捆绑包输出与索引 (Bundle Output & Index) ---
+
+BUNDLE_INDEX_TITLE = "# Bundle Index (machine-readable: one JSON entry per line, byte offsets into this file):"
+BUNDLE_INDEX_TRAILER = "# Bundle-Index-Offset: "
+
+
+class BundleWriter:
+    """
+    将输出内容直接写入打开的文本流 (输出文件或控制台输出的临时文件), 不在内存中保留,
+    同时跟踪已写入内容的 UTF-8 字节偏移, 用于生成捆绑包索引。
+    第一次写入失败后不再写入, 错误保存在 error 中, 由 finish_output() 报告。
+    """
+    __slots__ = ('stream', 'byte_offset', 'error', '_ends_with_newline')
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.byte_offset = 0
+        self.error: Optional[OSError] = None
+        self._ends_with_newline = True
+
+    def write(self, text: str):
+        if not text:
+            return
+        if self.error is None:
             try:
-                with open(gitignore_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line or line.startswith('#'):
-                            continue
-
-                        # 简化 .gitignore 规则处理：
-                        # - 如果以 / 结尾, 视为目录排除
-                        # - 否则, 视为文件/目录模式，同时加入到两个排除列表以确保覆盖
-                        if line.endswith('/'):
-                            pattern = line.strip('/')
-                            if pattern and pattern not in effective_exclude_dirs:
-                                effective_exclude_dirs.append(pattern)
-                        else:
-                            # 对于像 `__pycache__` 或 `*.log` 这样的模式,
-                            # 添加到文件排除列表。脚本的 match_file_pattern 支持 `*.ext` 形式。
-                            pattern = line.lstrip('/')  # 移除开头的斜杠
-                            if pattern not in effective_exclude_files:
-                                effective_exclude_files.append(pattern)
-                            # 如果模式不含通配符，也可能是个目录名
-                            if '*' not in pattern and '?' not in pattern and not Path(pattern).suffix:
-                                if pattern not in effective_exclude_dirs:
-                                    effective_exclude_dirs.append(pattern)
-            except Exception as e:
-                print(f"Warning: Could not read or process .gitignore file: {e}", file=sys.stderr)
+                self.stream.write(text)
+            except OSError as e:
+                self.error = e
+        self.byte_offset += len(text) if text.isascii() else len(text.encode('utf-8'))
+        self._ends_with_newline = text.endswith('\n')
+
+    def ends_with_newline(self) -> bool:
+        """内容为空或以换行结尾时返回 True。"""
+        return self._ends_with_newline
+
+
+def make_bundle_index_entry(filepath: str, offset: int, text: str, encoding: str) -> Dict[str, Any]:
+    """为写入捆绑包的一段文件内容生成索引条目 (偏移和长度均为 UTF-8 字节数)。"""
+    data = text.encode('utf-8')
+    return {
+        'path': filepath,
+        'offset': offset,
+        'length': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'encoding': encoding,
+    }
+
+
+def write_bundle_index(writer: BundleWriter, entries: List[Dict[str, Any]]):
+    """在捆绑包末尾追加索引: 标题行、每个文件一行 JSON, 最后一行记录索引起始的字节偏移。"""
+    index_offset = writer.byte_offset
+    writer.write("\n" + BUNDLE_INDEX_TITLE + "\n")
+    for entry in entries:
+        writer.write("# " + json.dumps(entry, ensure_ascii=False) + "\n")
+    writer.write(f"{BUNDLE_INDEX_TRAILER}{index_offset}\n")
+
+
+def list_bundle_files(bundle_path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """
+    读取捆绑包末尾的索引, 返回每个文件的索引条目 (path, offset, length, sha256, encoding)。
+    只读取索引部分, 不扫描文件内容。捆绑包没有索引时抛出 ValueError。
+    """
+    with open(bundle_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        trailer_marker = BUNDLE_INDEX_TRAILER.encode('utf-8')
+        trailer_pos = mm.rfind(trailer_marker, max(0, len(mm) - 256))
+        if trailer_pos < 0:
+            raise ValueError(f"No bundle index found in {bundle_path} (was ADD_BUNDLE_INDEX enabled?)")
+        index_offset = int(mm[trailer_pos + len(trailer_marker):].split(b'\n', 1)[0])
+        index_block = mm[index_offset:trailer_pos].decode('utf-8')
+
+    entries = []
+    for line in index_block.splitlines():
+        if line.startswith('# {'):
+            entries.append(json.loads(line[2:]))
+    return entries
+
+
+def extract_bundle_file(bundle_path: Union[str, Path], filepath: str, verify: bool = True) -> str:
+    """
+    使用索引从捆绑包中直接取出单个文件的内容 (通过 mmap 跳转到对应偏移)。
+    verify 为 True 时校验 SHA-256。文件不在索引中时抛出 KeyError。
+    """
+    filepath = normalize_path_pattern(filepath)
+    for entry in list_bundle_files(bundle_path):
+        if entry['path'] == filepath:
+            break
+    else:
+        raise KeyError(f"File not found in bundle index: {filepath}")
+
+    with open(bundle_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[entry['offset']:entry['offset'] + entry['length']]
+    if verify and hashlib.sha256(data).hexdigest() != entry['sha256']:
+        raise ValueError(f"Hash mismatch for {filepath} in {bundle_path} (bundle modified after generation?)")
+    return data.decode('utf-8')
+
+
+# --- 分块导出 (Chunked JSONL Export, Used only in Mode 1) ---
+
+CHUNKER_VERSION = 1  # Bump when the chunking rules change (invalidates the chunk cache)
+
+CHUNK_SUFFIX_LANGUAGES = {
+    '.py': 'python', '.pyi': 'python',
+    '.ts': 'typescript', '.tsx': 'typescript', '.mts': 'typescript', '.cts': 'typescript',
+    '.js': 'javascript', '.jsx': 'javascript', '.mjs': 'javascript', '.cjs': 'javascript',
+    '.css': 'css', '.scss': 'css', '.less': 'css',
+}
+BRACE_LANGUAGES = {'typescript', 'javascript', 'css'}
+# Adjacent chunks of these kinds are merged up to CHUNK_MAX_LINES (imports, constants, fields, CSS rules)
+MERGEABLE_CHUNK_KINDS = {'statements', 'field', 'rule'}
+
+# (start line, end line, kind, name); lines are 1-based and inclusive
+ChunkSpan = Tuple[int, int, str, str]
+
+_PYTHON_DEF_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+_BRACE_STRING_OR_COMMENT_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`|//.*$')
+_BRACE_DECLARATION_RE = re.compile(
+    r'^(?:export\s+)?(?:default\s+)?(?:declare\s+)?(?:abstract\s+)?(?:async\s+)?'
+    r'(function\*?|class|interface|type|enum|namespace|module|const|let|var)\s+([A-Za-z_$][\w$]*)')
+_BRACE_MEMBER_RE = re.compile(
+    r'^(?:(?:public|private|protected|static|readonly|async|get|set|override|abstract)\s+)*'
+    r'(#?[A-Za-z_$][\w$]*)\s*(?:[?!]\s*)?([(<:=])')
+_BRACE_KEYWORDS = {'if', 'for', 'while', 'switch', 'return', 'catch', 'else', 'do', 'try', 'throw', 'new', 'await'}
+
+
+def _python_node_start(node: ast.AST, lines: List[str]) -> int:
+    """定义的起始行: 包括装饰器和紧挨在上方的注释行。"""
+    start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+    while start > 1 and lines[start - 2].lstrip().startswith('#'):
+        start -= 1
+    return start
+
+
+def _chunk_python_body(body: List[ast.stmt], lines: List[str], first: int, last: int,
+                       prefix: str, max_lines: int) -> List[ChunkSpan]:
+    """将语句列表 (行 first..last) 切分为块: 每个函数/类一个块, 其间的其他语句各成一块 (稍后合并)。"""
+    spans: List[ChunkSpan] = []
+    cursor = first
+    for node in body:
+        if not isinstance(node, _PYTHON_DEF_TYPES):
+            continue
+        start, end = max(_python_node_start(node, lines), cursor), node.end_lineno
+        if start > cursor:
+            spans.append((cursor, start - 1, 'statements', prefix.rstrip('.')))
+        name = prefix + node.name
+        members = [child for child in node.body if isinstance(child, _PYTHON_DEF_TYPES)]
+        if isinstance(node, ast.ClassDef) and members and end - start + 1 > max_lines:
+            # Large class: the header (docstring, attributes) plus one chunk per method
+            first_member = max(_python_node_start(members[0], lines), start + 1)
+            spans.append((start, first_member - 1, 'class', name))
+            spans.extend(_chunk_python_body(node.body, lines, first_member, end, name + '.', max_lines))
         else:
-            print("Info: PROCESS_GITIGNORE is True, but no .gitignore file was found at the root.")
-    # <<<< MODIFICATION END >>>>
+            spans.append((start, end, 'class' if isinstance(node, ast.ClassDef) else 'function', name))
+        cursor = end + 1
+    if cursor <= last:
+        spans.append((cursor, last, 'statements', prefix.rstrip('.')))
+    return spans
 
-    # 1.5 Validate OUTPUT_MODE
+
+def _bracket_depths(lines: List[str]) -> Tuple[List[int], List[bool]]:
+    """
+    计算每行末尾的括号深度 ({[( 计为一层), 忽略字符串和注释中的括号 (启发式, 不处理跨行字符串)。
+    同时返回每行是否包含代码 (非空且不只是注释)。
+    """
+    depths: List[int] = []
+    has_code: List[bool] = []
+    depth = 0
+    in_comment = False
+    for line in lines:
+        pieces: List[str] = []
+        pos = 0
+        while pos < len(line):
+            if in_comment:
+                comment_end = line.find('*/', pos)
+                if comment_end < 0:
+                    break
+                in_comment = False
+                pos = comment_end + 2
+            else:
+                comment_start = line.find('/*', pos)
+                if comment_start < 0:
+                    pieces.append(line[pos:])
+                    break
+                pieces.append(line[pos:comment_start])
+                in_comment = True
+                pos = comment_start + 2
+        # Strings become empty literals (still code), line comments are removed
+        code = _BRACE_STRING_OR_COMMENT_RE.sub(lambda m: '' if m.group().startswith('//') else '""', ''.join(pieces))
+        depth += sum(code.count(c) for c in '{[(') - sum(code.count(c) for c in '}])')
+        depth = max(depth, 0)
+        depths.append(depth)
+        has_code.append(bool(code.strip()))
+    return depths, has_code
+
+
+def _describe_brace_unit(lines: List[str], depths: List[int], has_code: List[bool], first: int, last: int,
+                         level: int, language: str, prefix: str, in_class: bool) -> Tuple[str, str]:
+    """根据单元的第一行代码推断 (kind, name)。in_class: 单元位于类/接口主体中 (识别方法和字段)。"""
+    for line_no in range(first, last + 1):
+        depth_before = depths[line_no - 2] if line_no > 1 else 0
+        if not has_code[line_no - 1] or depth_before != level:
+            continue  # Comments, blank lines and continuation lines (e.g. decorator arguments)
+        code = lines[line_no - 1].strip()
+        if language != 'css' and code.startswith('@'):
+            continue  # Decorator: the name comes from the declaration that follows
+        if language == 'css':
+            return 'rule', code.split('{', 1)[0].strip()
+        if code.startswith(('import ', 'export {', 'export *')):
+            return 'statements', ''
+        match = _BRACE_DECLARATION_RE.match(code)
+        if match:
+            keyword, name = match.groups()
+            if keyword in ('const', 'let', 'var'):
+                unit_text = '\n'.join(lines[line_no - 1:last])
+                if '=>' not in unit_text and 'function' not in unit_text:
+                    return 'statements', ''
+                keyword = 'function'
+            return keyword.rstrip('*'), prefix + name
+        match = _BRACE_MEMBER_RE.match(code)
+        if in_class and match and match.group(1) not in _BRACE_KEYWORDS:
+            return ('function' if match.group(2) in '(<' or '=>' in code else 'field'), prefix + match.group(1)
+        return 'statements', ''
+    return 'statements', ''
+
+
+def _chunk_brace_block(lines: List[str], depths: List[int], has_code: List[bool], first: int, last: int,
+                       level: int, prefix: str, max_lines: int, language: str,
+                       in_class: bool = False) -> List[ChunkSpan]:
+    """
+    将行 first..last (括号深度 >= level) 切分为单元: 块在括号深度回到 level 时结束,
+    语句在以 ';' 结尾或遇到空行时结束。过大的块 (如类、函数) 在其 '{' 主体的下一层继续切分。
+    """
+    spans: List[ChunkSpan] = []
+    unit_start = first
+    opened_line = 0  # First line of the unit that opened a deeper block
+    in_decorator = False  # A decorator belongs to the declaration that follows it
+    for line_no in range(first, last + 1):
+        stripped = lines[line_no - 1].strip()
+        if language != 'css' and stripped.startswith('@') and (line_no == 1 or depths[line_no - 2] == level):
+            in_decorator = True
+        if depths[line_no - 1] > level:
+            opened_line = opened_line or line_no
+            continue
+        next_blank = line_no == last or not lines[line_no].strip()
+        if in_decorator and not stripped.endswith(';'):
+            in_decorator = False
+            opened_line = 0
+            continue
+        if not (opened_line or stripped.endswith(';') or next_blank):
+            continue  # Statement continues
+
+        kind, name = _describe_brace_unit(lines, depths, has_code, unit_start, line_no, level, language,
+                                          prefix, in_class)
+        # The body starts at the first line ending with '{' (after any multi-line parameter list)
+        body_line = next((n for n in range(opened_line, line_no - 1) if lines[n - 1].rstrip().endswith('{')),
+                         0) if opened_line and line_no - unit_start + 1 > max_lines else 0
+        if body_line:
+            # Large block: header line(s), members of the body, closing line appended to the last member
+            inner_prefix = '' if language == 'css' else (name + '.' if name else prefix)
+            spans.append((unit_start, body_line, kind, name))
+            inner = _chunk_brace_block(lines, depths, has_code, body_line + 1, line_no - 1, depths[body_line - 1],
+                                       inner_prefix, max_lines, language, kind in ('class', 'interface'))
+            if inner:
+                inner[-1] = (inner[-1][0], line_no) + inner[-1][2:]
+                spans.extend(inner)
+            else:
+                spans[-1] = (unit_start, line_no, kind, name)
+        else:
+            spans.append((unit_start, line_no, kind, name))
+        unit_start = line_no + 1
+        opened_line = 0
+        in_decorator = False
+    if unit_start <= last:
+        spans.append((unit_start, last) + _describe_brace_unit(lines, depths, has_code, unit_start, last, level,
+                                                               language, prefix, in_class))
+    return spans
+
+
+def _trim_blank_lines(start: int, end: int, lines: List[str]) -> Tuple[int, int]:
+    """去掉行范围首尾的空行 (全为空行时 start > end)。"""
+    while start <= end and not lines[start - 1].strip():
+        start += 1
+    while end >= start and not lines[end - 1].strip():
+        end -= 1
+    return start, end
+
+
+def _finalize_chunk_spans(spans: List[ChunkSpan], lines: List[str], max_lines: int) -> List[ChunkSpan]:
+    """去掉块首尾的空行和空块, 合并相邻的零散语句, 并将过长的块按行数切分。"""
+    trimmed: List[ChunkSpan] = []
+    for start, end, kind, name in spans:
+        start, end = _trim_blank_lines(start, end, lines)
+        if start > end:
+            continue
+        if (trimmed and kind in MERGEABLE_CHUNK_KINDS and trimmed[-1][2] == kind and
+                end - trimmed[-1][0] + 1 <= max_lines):
+            trimmed[-1] = (trimmed[-1][0], end, kind, trimmed[-1][3])
+            continue
+        trimmed.append((start, end, kind, name))
+
+    result: List[ChunkSpan] = []
+    for start, end, kind, name in trimmed:
+        for window_start in range(start, end + 1, max_lines):
+            window_start, window_end = _trim_blank_lines(window_start, min(window_start + max_lines - 1, end), lines)
+            if window_start <= window_end:
+                result.append((window_start, window_end, kind, name))
+    return result
+
+
+def chunk_file_text(text: str, language: str, max_lines: int) -> List[ChunkSpan]:
+    """按语言将文件文本切分为块 (Python 使用 ast, TS/JS/CSS 使用括号启发式, 其他按行数)。"""
+    lines = text.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    if not lines:
+        return []
+    spans: Optional[List[ChunkSpan]] = None
+    if language == 'python':
+        try:
+            spans = _chunk_python_body(ast.parse(text).body, lines, 1, len(lines), '', max_lines)
+        except (SyntaxError, ValueError, RecursionError):
+            spans = None  # Not valid Python 3: fall back to fixed-size chunks
+    elif language in BRACE_LANGUAGES:
+        depths, has_code = _bracket_depths(lines)
+        spans = _chunk_brace_block(lines, depths, has_code, 1, len(lines), 0, '', max_lines, language)
+    if spans is None:
+        spans = [(1, len(lines), 'text', '')]
+    return _finalize_chunk_spans(spans, lines, max_lines)
+
+
+def chunk_notebook_text(text: str, max_lines: int) -> List[ChunkSpan]:
+    """提取后的笔记本文本按单元标记切分: 每个单元 (及其保留的输出) 一个块。"""
+    lines = text.split('\n')
+    spans: List[ChunkSpan] = []
+    for line_no, line in enumerate(lines, 1):
+        if line.startswith(NOTEBOOK_CELL_MARKER + " ["):
+            cell_type, _, cell_name = line[len(NOTEBOOK_CELL_MARKER) + 2:].partition('] ')
+            spans.append((line_no, line_no, cell_type, cell_name.split(' (', 1)[0]))
+        elif spans:
+            spans[-1] = (spans[-1][0], line_no) + spans[-1][2:]
+        else:
+            spans.append((line_no, line_no, 'statements', ''))  # The notebook header line
+    return _finalize_chunk_spans(spans, lines, max_lines)
+
+
+class ChunkCache:
+    """
+    分块边界缓存 (JSON), 以 "语言:文件内容哈希" 为键。内容未变的文件直接复用上次的分块,
+    不再重新解析。只保存本次运行用到的条目; CHUNKER_VERSION 或 CHUNK_MAX_LINES 改变时缓存失效。
+    """
+
+    def __init__(self, cache_path: Path, max_lines: int):
+        self.cache_path = cache_path
+        self.max_lines = max_lines
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, List[List[Any]]] = {}
+        self._used: Dict[str, List[List[Any]]] = {}
+        if cache_path.is_file():
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('chunker_version') == CHUNKER_VERSION and data.get('max_lines') == max_lines:
+                    self._entries = data.get('files', {})
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"Warning: Could not read chunk cache {cache_path}: {e}. Rebuilding it.", file=sys.stderr)
+
+    def get(self, key: str) -> Optional[List[ChunkSpan]]:
+        cached = self._entries.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[key] = cached
+        return [tuple(span) for span in cached]
+
+    def put(self, key: str, spans: List[ChunkSpan]):
+        self._used[key] = [list(span) for span in spans]
+
+    def save(self):
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump({'chunker_version': CHUNKER_VERSION, 'max_lines': self.max_lines, 'files': self._used},
+                      f, ensure_ascii=False, separators=(',', ':'))
+
+
+def make_chunk_records(relative_path: Path, text: str, encoding: str, max_lines: int,
+                       chunk_cache: Optional[ChunkCache] = None) -> List[str]:
+    """
+    为写入捆绑包的文件内容生成分块导出记录 (每条为一行 JSON)。
+    数据文件摘要作为一个 'summary' 块输出; 读取失败的文件不产生记录。
+    """
+    if encoding == ENCODING_ERROR:
+        return []
+    path_posix = relative_path.as_posix()
+    file_sha256 = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    language = CHUNK_SUFFIX_LANGUAGES.get(relative_path.suffix.lower(), 'text')
+    if encoding == ENCODING_SUMMARY:
+        language = 'summary'
+        spans = _finalize_chunk_spans([(1, text.count('\n') + 1, 'summary', '')], text.split('\n'), max_lines)
+    elif encoding == ENCODING_NOTEBOOK:
+        language = 'notebook'
+        spans = chunk_notebook_text(text, max_lines)
+    else:
+        cache_key = f"{language}:{file_sha256}"
+        spans = chunk_cache.get(cache_key) if chunk_cache is not None else None
+        if spans is None:
+            spans = chunk_file_text(text, language, max_lines)
+            if chunk_cache is not None:
+                chunk_cache.put(cache_key, spans)
+
+    lines = text.split('\n')
+    records: List[str] = []
+    for start, end, kind, name in spans:
+        content = '\n'.join(lines[start - 1:end]) + '\n'
+        records.append(json.dumps({
+            'id': f"{path_posix}#L{start}-L{end}",
+            'path': path_posix,
+            'start_line': start,
+            'end_line': end,
+            'kind': kind,
+            'name': name,
+            'language': language,
+            'sha256': hashlib.sha256(content.encode('utf-8')).hexdigest(),
+            'file_sha256': file_sha256,
+            'content': content,
+        }, ensure_ascii=False))
+    return records
+
+
+def write_chunk_records(export_file: TextIO, records: List[str]):
+    """将分块记录追加到分块导出文件 (JSONL, 每行一个块)。"""
+    for record in records:
+        export_file.write(record)
+        export_file.write('\n')
+
+
+# --- 配置准备 (Configuration) ---
+
+# Profile keys and the global settings they default to
+PROFILE_SETTINGS: Dict[str, str] = {
+    'output_mode': 'OUTPUT_MODE',
+    'include_full_structure_tree': 'INCLUDE_FULL_STRUCTURE_TREE',
+    'add_summary_header': 'ADD_SUMMARY_HEADER',
+    'exclude_dirs': 'EXCLUDE_DIRS',
+    'exclude_files': 'EXCLUDE_FILES',
+    'exclude_extensions': 'EXCLUDE_EXTENSIONS',
+    'include_files': 'INCLUDE_FILES',
+    'include_subdirs': 'INCLUDE_SUBDIRS',
+    'include_extensions': 'INCLUDE_EXTENSIONS',
+}
+PROFILE_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def resolve_output_profiles() -> List[Dict[str, Any]]:
+    """
+    返回本次运行的输出配置列表, 每项包含 'name' 和 PROFILE_SETTINGS 中的所有设置。
+    OUTPUT_PROFILES 为空时返回一个使用全局设置的配置 (name 为 None)。配置无效时退出。
+    """
+    defaults = {key: globals()[name] for key, name in PROFILE_SETTINGS.items()}
+    if not OUTPUT_PROFILES:
+        return [dict(defaults, name=None)]
+
+    if len(OUTPUT_PROFILES) > ScanStore.MAX_PROFILES:
+        print(f"Error: At most {ScanStore.MAX_PROFILES} OUTPUT_PROFILES are supported.", file=sys.stderr)
+        sys.exit(1)
+    profiles = []
+    seen_names: Set[str] = set()
+    for profile in OUTPUT_PROFILES:
+        name = profile.get('name')
+        if not isinstance(name, str) or not PROFILE_NAME_RE.match(name) or name in seen_names:
+            print(f"Error: Every output profile needs a unique 'name' made of letters, digits, '-' or '_' "
+                  f"(got {name!r}).", file=sys.stderr)
+            sys.exit(1)
+        seen_names.add(name)
+        unknown_keys = set(profile) - set(PROFILE_SETTINGS) - {'name'}
+        if unknown_keys:
+            print(f"Warning: Ignoring unknown settings in output profile '{name}': {sorted(unknown_keys)}",
+                  file=sys.stderr)
+        profiles.append(dict(defaults, **{k: v for k, v in profile.items() if k in PROFILE_SETTINGS}, name=name))
+    return profiles
+
+
+def profile_filename(filename: str, profile_name: Optional[str]) -> str:
+    """在文件名的扩展名之前加入配置名称 (如 'manifest.json' -> 'manifest_python.json')。"""
+    if not profile_name:
+        return filename
+    base_name, ext = os.path.splitext(filename)
+    return f"{base_name}_{profile_name}{ext}"
+
+
+def read_gitignore_rules(source: ProjectSource) -> List[str]:
+    """读取项目根目录下 .gitignore 的规则行 (去除空行和注释)。"""
+    rules: List[str] = []
+    gitignore_path = Path(".gitignore")
+    if source.is_file(gitignore_path):
+        print(f"Found and processing: {source.describe(gitignore_path)}")
+        try:
+            with source.open_binary(gitignore_path) as raw_file, io.TextIOWrapper(raw_file, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        rules.append(line)
+        except Exception as e:
+            print(f"Warning: Could not read or process .gitignore file: {e}", file=sys.stderr)
+    else:
+        print("Info: PROCESS_GITIGNORE is True, but no .gitignore file was found at the root.")
+    return rules
+
+
+def apply_gitignore_rules(exclude_dirs: List[str], exclude_files: List[str],
+                          rules: List[str]) -> Tuple[List[str], List[str]]:
+    """将 .gitignore 规则追加到排除列表的副本中, 返回 (effective_exclude_dirs, effective_exclude_files)。"""
+    # 为了避免直接修改原始配置列表，我们创建副本
+    effective_exclude_dirs = list(exclude_dirs)
+    effective_exclude_files = list(exclude_files)
+    for line in rules:
+        # 简化 .gitignore 规则处理：
+        # - 如果以 / 结尾, 视为目录排除
+        # - 否则, 视为文件/目录模式，同时加入到两个排除列表以确保覆盖
+        if line.endswith('/'):
+            pattern = line.strip('/')
+            if pattern and pattern not in effective_exclude_dirs:
+                effective_exclude_dirs.append(pattern)
+        else:
+            # 对于像 `__pycache__` 或 `*.log` 这样的模式,
+            # 添加到文件排除列表。脚本的 match_file_pattern 支持 `*.ext` 形式。
+            pattern = line.lstrip('/')  # 移除开头的斜杠
+            if pattern not in effective_exclude_files:
+                effective_exclude_files.append(pattern)
+            # 如果模式不含通配符，也可能是个目录名
+            if '*' not in pattern and '?' not in pattern and not Path(pattern).suffix:
+                if pattern not in effective_exclude_dirs:
+                    effective_exclude_dirs.append(pattern)
+    return effective_exclude_dirs, effective_exclude_files
+
+
+def build_config(profile: Dict[str, Any], gitignore_rules: List[str], generated_filenames: Set[str]) -> ConfigDict:
+    """根据一个输出配置 (profile) 准备配置字典 (进行标准化和预处理)。"""
+    profile_name = profile['name']
+    effective_exclude_dirs, effective_exclude_files = apply_gitignore_rules(
+        profile['exclude_dirs'], profile['exclude_files'], gitignore_rules)
+
+    # Validate OUTPUT_MODE
     valid_modes = [1, 2, 3]
-    current_output_mode = OUTPUT_MODE
+    current_output_mode = profile['output_mode']
     if current_output_mode not in valid_modes:
         print(
-            f"Warning: Invalid OUTPUT_MODE ({current_output_mode}) specified. Must be 1, 2, or 3. Defaulting to 1 (Full Bundle).",
+            f"Warning: Invalid OUTPUT_MODE ({current_output_mode}) specified"
+            f"{f' in profile {profile_name!r}' if profile_name else ''}. "
+            f"Must be 1, 2, or 3. Defaulting to 1 (Full Bundle).",
             file=sys.stderr)
         current_output_mode = 1
 
-    # 2. 准备配置字典 (进行标准化和预处理)
-    # !! 使用上面处理过的 effective_exclude_* 列表 !!
+    # Validate GENERATED_FILES ("off" disables detection)
+    generated_files = (GENERATED_FILES or "").strip().lower()
+    if generated_files == "off":
+        generated_files = ""
+    elif generated_files not in ("", GENERATED_FILES_SUMMARY, GENERATED_FILES_SKIP):
+        print(f"Warning: Invalid GENERATED_FILES ({GENERATED_FILES!r}) specified. "
+              f"Must be 'summary', 'skip' or 'off'. Defaulting to 'summary'.", file=sys.stderr)
+        generated_files = GENERATED_FILES_SUMMARY
+
+    # The delta base is a per-profile manifest unless it is a git revision
+    delta_base = (DELTA_BASE or "").strip()
+    if delta_base and not delta_base.startswith('git:'):
+        delta_base = profile_filename(delta_base, profile_name)
+
+    # !! 使用处理过 .gitignore 的 effective_exclude_* 列表 !!
     config: ConfigDict = {
+        'profile_name': profile_name,
         # Processed/normalized versions for internal use
         'exclude_dirs': [normalize_path_pattern(p).strip('/') for p in effective_exclude_dirs if p],
         'exclude_files': [normalize_path_pattern(p) for p in effective_exclude_files if p],
-        'exclude_extensions': [e.lower() for e in EXCLUDE_EXTENSIONS if e],
-        'include_files': [normalize_path_pattern(p) for p in INCLUDE_FILES if p],
-        'include_subdirs': [normalize_path_pattern(p).strip('/') for p in INCLUDE_SUBDIRS if p],
-        'include_extensions': [e.lower() for e in INCLUDE_EXTENSIONS if e],
+        'exclude_extensions': [e.lower() for e in profile['exclude_extensions'] if e],
+        'include_files': [normalize_path_pattern(p) for p in profile['include_files'] if p],
+        'include_subdirs': [normalize_path_pattern(p).strip('/') for p in profile['include_subdirs'] if p],
+        'include_extensions': [e.lower() for e in profile['include_extensions'] if e],
         'separator': FILE_SEPARATOR_TEMPLATE,
-        'add_summary': ADD_SUMMARY_HEADER if current_output_mode == 1 else False,  # Only add summary in Mode 1
+        'add_bundle_index': ADD_BUNDLE_INDEX if current_output_mode == 1 else False,  # Only Mode 1 has content
+        'data_summary_threshold': DATA_SUMMARY_THRESHOLD_BYTES or 0,
+        'data_summary_sample_rows': max(DATA_SUMMARY_SAMPLE_ROWS, 0),
+        'data_summary_sample_items': max(DATA_SUMMARY_SAMPLE_ITEMS, 1),
+        'notebook_extract': NOTEBOOK_EXTRACT,
+        'notebook_output_lines': max(NOTEBOOK_OUTPUT_LINES or 0, 0),
+        'generated_files': generated_files,
+        # Only add summary in Mode 1
+        'add_summary': profile['add_summary_header'] if current_output_mode == 1 else False,
         'output_mode': current_output_mode,  # Store validated mode
-        'include_full_structure_tree': INCLUDE_FULL_STRUCTURE_TREE,
+        'include_full_structure_tree': profile['include_full_structure_tree'],
         'output_header_separator': OUTPUT_HEADER_SEPARATOR,
         'output_header_explanation': OUTPUT_HEADER_EXPLANATION.strip(),
         # Keep original lists for the summary header for better readability
         # !! 使用 effective 列表，以便摘要头能反映 .gitignore 的内容 !!
         'orig_exclude_dirs': effective_exclude_dirs,
         'orig_exclude_files': effective_exclude_files,
-        'orig_exclude_extensions': EXCLUDE_EXTENSIONS,
-        'orig_include_files': INCLUDE_FILES,
-        'orig_include_subdirs': INCLUDE_SUBDIRS,
-        'orig_include_extensions': INCLUDE_EXTENSIONS,
+        'orig_exclude_extensions': profile['exclude_extensions'],
+        'orig_include_files': profile['include_files'],
+        'orig_include_subdirs': profile['include_subdirs'],
+        'orig_include_extensions': profile['include_extensions'],
         # Keep original output filename for exclusion checks
         'orig_output_filename': OUTPUT_FILENAME,
+        # May contain a directory part (relative to the script directory); the hardcoded exclusion matches the name only
+        'orig_manifest_filename': (profile_filename(normalize_path_pattern(MANIFEST_FILENAME), profile_name)
+                                   if MANIFEST_FILENAME else None),
+        'orig_scan_cache_filename': Path(SCAN_CACHE_FILENAME).name if SCAN_CACHE_FILENAME else None,
+        'orig_chunk_export_filename': (profile_filename(Path(CHUNK_EXPORT_FILENAME).name, profile_name)
+                                       if CHUNK_EXPORT_FILENAME and current_output_mode == 1 else None),
+        'chunk_max_lines': max(CHUNK_MAX_LINES, 1),
+        # Helper files written by the script (manifests of all profiles, scan cache): always excluded
+        'generated_filenames': generated_filenames,
+        'delta_base': delta_base,
+        'delta_description': None,  # Set once a delta base has been resolved
     }
     # MODIFICATION: Removed the pre-processing of extensions, as the logic
     # now handles dotfiles and extensions directly in the filter functions.
 
     # Normalize include_subdirs to posix paths for comparison
     config['include_subdirs_posix'] = [p for p in config['include_subdirs']]
+    return config
+
+
+# --- 输出生成 (Output Generation) ---
+
+class ProfileRun:
+    """一个输出配置在本次运行中的状态: 配置、扫描位、被包含的文件、增量结果和打开的输出。"""
+    __slots__ = ('config', 'bit', 'included_ids', 'delta_changes', 'manifest_entries',
+                 'bundle_index_entries', 'output_path', 'writer', 'chunk_export', 'chunk_count')
+
+    def __init__(self, config: ConfigDict, bit: int, included_ids: array):
+        self.config = config
+        self.bit = bit
+        self.included_ids = included_ids
+        self.delta_changes: Optional[Dict[str, str]] = None  # None = not a delta bundle
+        self.manifest_entries: ManifestEntries = {}  # Entries that can be reused without re-reading
+        self.bundle_index_entries: List[Dict[str, Any]] = []
+        self.output_path: Optional[Path] = None  # None = console output (spooled to a temporary file)
+        self.writer: Optional[BundleWriter] = None  # Set by open_output()
+        self.chunk_export: Optional[TextIO] = None  # Open CHUNK_EXPORT_FILENAME file
+        self.chunk_count = 0
+
+    def wants_content(self, relative_path_posix: str) -> bool:
+        """该配置是否需要输出此 (被包含) 文件的内容。Delta bundles only carry added and modified files."""
+        return self.delta_changes is None or self.delta_changes.get(relative_path_posix) in (DELTA_ADDED,
+                                                                                            DELTA_MODIFIED)
+
+
+def compute_profile_delta(run: ProfileRun, scan_store: ScanStore, root_dir_path: Path,
+                          script_dir: Path, script_name: str):
+    """(可选) 计算增量: 与之前的清单或 git 修订版比较, 结果保存在 run 中。"""
+    config = run.config
+    if config['delta_base'] and config['output_mode'] != 1:
+        print(f"Info: DELTA_BASE is only used in Mode 1, ignoring it for Mode {config['output_mode']}.")
+        return
+    if not config['delta_base']:
+        return
+
+    included_paths = (scan_store.relative_path(entry_id) for entry_id in run.included_ids)
+    delta_base = config['delta_base']
+    try:
+        if delta_base.startswith('git:'):
+            revision = delta_base[len('git:'):].strip() or 'HEAD'
+            print(f"Computing changes against git revision: {revision}")
+            run.delta_changes = compute_git_delta(root_dir_path, revision, included_paths, config, script_name)
+            config['delta_description'] = f"git revision '{revision}'"
+            previous_manifest_path = script_dir / config['orig_manifest_filename'] \
+                if config['orig_manifest_filename'] else None
+            if previous_manifest_path is not None and previous_manifest_path.is_file():
+                # The manifest written at the end covers all included files; unchanged ones need no re-hashing
+                try:
+                    run.manifest_entries = reuse_manifest_entries(
+                        root_dir_path, (scan_store.relative_path(entry_id) for entry_id in run.included_ids),
+                        run.delta_changes, load_bundle_manifest(previous_manifest_path))
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Could not reuse manifest {previous_manifest_path}: {e}", file=sys.stderr)
+        else:
+            manifest_path = Path(delta_base)
+            if not manifest_path.is_absolute():
+                manifest_path = script_dir / manifest_path
+            print(f"Computing changes against manifest: {manifest_path}")
+            run.delta_changes, run.manifest_entries = compute_manifest_delta(
+                root_dir_path, included_paths, load_bundle_manifest(manifest_path))
+            config['delta_description'] = f"manifest '{manifest_path.name}'"
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Error: Could not compute delta against '{delta_base}': {e}", file=sys.stderr)
+        sys.exit(1)
+    delta_changes = run.delta_changes
+    print(f"Delta: {len(delta_changes)} changed files "
+          f"({sum(1 for s in delta_changes.values() if s == DELTA_ADDED)} added, "
+          f"{sum(1 for s in delta_changes.values() if s == DELTA_MODIFIED)} modified, "
+          f"{sum(1 for s in delta_changes.values() if s == DELTA_DELETED)} deleted).")
 
-    # 3. 遍历、收集所有路径、筛选文件
-    files_to_bundle: List[Path] = []  # Only relevant for modes 1 and 2
-    all_scanned_paths: List[Path] = []  # Relative paths of ALL files/dirs encountered after dir exclusion
-    print("Scanning files and directories...")
 
-    # Using os.walk for efficient directory exclusion
-    for dirpath_str, dirnames, filenames in os.walk(root_dir_path, topdown=True, onerror=lambda e: print(
-            f"Warning: Cannot access path {e.filename}: {e}", file=sys.stderr)):
-        dirpath = Path(dirpath_str)
-        relative_dir_path = dirpath.relative_to(root_dir_path)
-
-        # --- Directory Exclusion during Walk (Based ONLY on EXCLUDE_DIRS config) ---
-        original_dirnames = dirnames[:]  # Iterate over a copy
-        dirnames.clear()  # Modify the list os.walk uses
-        kept_dirnames = []
-        for dname in original_dirnames:
-            d_relative_path = relative_dir_path / dname
-            # Use the specific helper that only checks EXCLUDE_DIRS
-            if not is_dir_excluded(d_relative_path, config['exclude_dirs']):
-                dirnames.append(dname)  # Allow walk to descend
-                kept_dirnames.append(dname)  # Keep track for adding to all_scanned_paths
-            # else:
-            # print(f"DEBUG: Pruning walk at directory: {d_relative_path.as_posix()}") # 可选调试
-
-        # --- Add kept directories and current directory (if not root) to full list ---
-        if relative_dir_path != Path('.'):  # Add the current directory itself unless it's the root
-            all_scanned_paths.append(relative_dir_path)
-        for dname in kept_dirnames:  # Add subdirectories that were not pruned
-            all_scanned_paths.append(relative_dir_path / dname)
-
-        # --- File Processing ---
-        for filename in filenames:
-            file_path = dirpath / filename
-            relative_path = file_path.relative_to(root_dir_path)
-
-            # Add ALL encountered files (relative path) to the full scanned list (for Mode 3 tree)
-            all_scanned_paths.append(relative_path)
-
-            # Apply filtering logic ONLY if needed (Mode 1 or 2)
-            if config['output_mode'] in [1, 2]:
-                # Pass script_name and original output filename to is_file_excluded
-                if not is_file_excluded(relative_path, config, script_name):  # Checks hardcoded AND config exclusions
-                    if passes_inclusion_rules(relative_path, config):  # Checks include logic
-                        files_to_bundle.append(relative_path)
-                    # else: # Optional debug for files excluded by inclusion rules
-                    # print(f"DEBUG: File excluded by inclusion rules: {relative_path.as_posix()}")
-                # else: # Optional debug for files excluded by exclusion rules (hardcoded or config)
-                # print(f"DEBUG: File excluded by is_file_excluded: {relative_path.as_posix()}")
-
-    # 4. 排序文件列表 (for consistent output)
-    files_to_bundle.sort()
-    # Sort all paths as well for the full tree display consistency
-    # No need to sort all_scanned_paths here, build_tree_from_paths does internal sorting
-
-    print(f"Total items scanned (files/dirs after directory exclusion): {len(all_scanned_paths)}")
-    if config['output_mode'] in [1, 2]:
-        print(f"Found {len(files_to_bundle)} files matching the inclusion criteria (for Mode {config['output_mode']}).")
-
-    # 5. 生成输出内容 based on OUTPUT_MODE
-    output_buffer = io.StringIO()
-    generation_time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S %Z")
+def write_header_and_structure(run: ProfileRun, scan_store: ScanStore, total_scanned: int,
+                               root_dir_path: Path, script_dir: Path, generation_time_str: str):
+    """写入输出头部、结构树和摘要头 (文件内容之前的所有部分)。"""
+    config = run.config
+    output_buffer = run.writer
+    delta_changes = run.delta_changes
 
     # --- Generate Header ---
     mode_description = "Unknown"
@@ -708,7 +2940,16 @@ def main():
     include_full_tree_flag = config.get('include_full_structure_tree', True)  # Get flag value
 
     # Determine content details based on mode and flags
-    if config['output_mode'] == 1:
+    if config['output_mode'] == 1 and delta_changes is not None:
+        mode_description = "1 (Delta Bundle)"
+        content_details_lines.append(
+            f"- Tree of files added/modified/deleted since {config['delta_description']}.")
+        if config['add_summary']:
+            content_details_lines.append("- Summary of filtering rules.")
+        content_details_lines.append("- Concatenated content of added and modified files.")
+        if config['add_bundle_index']:
+            content_details_lines.append("- Bundle index (byte offsets of each file) at the end.")
+    elif config['output_mode'] == 1:
         mode_description = "1 (Full Bundle)"
         if include_full_tree_flag:
             content_details_lines.append("- Complete scanned project structure (respecting directory exclusions).")
@@ -718,6 +2959,8 @@ def main():
         if config['add_summary']:
             content_details_lines.append("- Summary of filtering rules.")
         content_details_lines.append("- Concatenated content of included files.")
+        if config['add_bundle_index']:
+            content_details_lines.append("- Bundle index (byte offsets of each file) at the end.")
     elif config['output_mode'] == 2:
         mode_description = "2 (Filtered Structure Only)"
         content_details_lines.append("- Filtered file structure (showing files that meet inclusion/exclusion rules).")
@@ -727,6 +2970,8 @@ def main():
             content_details_lines.append("- Complete scanned project structure (respecting directory exclusions).")
         else:
             content_details_lines.append("- Complete scanned project structure: [DISABLED BY CONFIG]")
+    if config['profile_name']:
+        mode_description += f" - Profile '{config['profile_name']}'"
 
     content_details = "\n#    ".join(content_details_lines)  # Format for multi-line display in header
 
@@ -743,15 +2988,30 @@ def main():
 
     # --- Generate Content Sections based on Mode ---
 
+    # -- Section: Changed File Structure (Mode 1 delta bundles replace both trees) --
+    if delta_changes is not None:
+        print("Generating changed file structure tree...")
+        if not delta_changes:
+            output_buffer.write(
+                f"# Changed File Structure (Since {config['delta_description']}):\n# (No changes)\n")
+            output_buffer.write("# " + "=" * 60 + "\n")
+        else:
+            output_buffer.write(generate_tree_string(
+                f"Changed File Structure (Since {config['delta_description']})",
+                build_delta_tree(delta_changes),
+                root_display=root_dir_path.name
+            ))
+        output_buffer.write("\n")
+
     # -- Section: Full Project Structure (Modes 1 and 3, if enabled by config) --
-    if config['output_mode'] in [1, 3] and config['include_full_structure_tree']:
+    elif config['output_mode'] in [1, 3] and config['include_full_structure_tree']:
         print("Generating full project structure tree...")
-        if not all_scanned_paths:
+        full_project_tree = scan_store.build_tree(profile_bit=run.bit)
+        if not total_scanned or not full_project_tree:
             output_buffer.write(
                 "# Full Project Structure (Scan Results):\n# (No files or directories found/kept after directory exclusion)\n")
             output_buffer.write("# " + "=" * 60 + "\n\n")
         else:
-            full_project_tree = build_tree_from_paths(all_scanned_paths, root_dir_path)
             full_tree_string = generate_tree_string(
                 "Full Project Structure (Scan Results - Respects EXCLUDE_DIRS)",
                 full_project_tree,
@@ -765,15 +3025,15 @@ def main():
         output_buffer.write("# " + "=" * 60 + "\n\n")
 
     # -- Section: Filtered File Structure (Modes 1 and 2) --
-    if config['output_mode'] in [1, 2]:
+    if config['output_mode'] in [1, 2] and delta_changes is None:
         print("Generating included file structure tree...")
-        if not files_to_bundle:
+        if not run.included_ids:
             print("No files matched the criteria for inclusion.")
             output_buffer.write(
                 "# Included File Structure (After Filtering):\n# (No files matched inclusion criteria)\n")
             output_buffer.write("# " + "=" * 60 + "\n")
         else:
-            included_file_tree_dict = build_tree_from_paths(files_to_bundle, root_dir_path)
+            included_file_tree_dict = scan_store.build_tree(run.included_ids)
             included_tree_string = generate_tree_string(
                 "Included File Structure (After Filtering)",
                 included_file_tree_dict,
@@ -787,63 +3047,144 @@ def main():
         output_buffer.write(create_summary_header(root_dir_path, config))
         output_buffer.write("\n")
 
-    # -- Section: File Content (Mode 1 only) --
-    if config['output_mode'] == 1:
-        if files_to_bundle:
-            print("Adding file contents...")
-            for relative_path in files_to_bundle:
-                file_path = root_dir_path / relative_path
-                separator = config['separator'].format(filepath=relative_path.as_posix())
-                output_buffer.write(separator)
 
+def write_file_contents(runs: List[ProfileRun], scan_store: ScanStore, source: ProjectSource,
+                        chunk_cache: Optional[ChunkCache] = None):
+    """
+    为所有 Mode 1 配置写入文件内容。按路径顺序遍历所有配置需要的文件的并集,
+    每个文件只读取一次, 然后写入每个需要它的配置的输出中 (以及分块导出记录)。
+    """
+    bundle_runs = [run for run in runs if run.config['output_mode'] == 1]
+    if not bundle_runs:
+        return
+
+    # Map each file id to the profiles that want its content
+    wanted: Dict[int, List[ProfileRun]] = {}
+    for run in bundle_runs:
+        for entry_id in run.included_ids:
+            # Only delta bundles need the path to decide
+            if run.delta_changes is None or run.wants_content(scan_store.relative_path(entry_id).as_posix()):
+                wanted.setdefault(entry_id, []).append(run)
+
+    runs_with_content: Set[int] = set()
+    skipped_files: List[str] = []
+    if wanted:
+        print("Adding file contents...")
+    # Content settings (data summaries, notebooks, generated files) are global, so any profile's config renders
+    # the same content
+    render_config = bundle_runs[0].config
+    wanted_ids = sorted(wanted, key=scan_store.sort_key)
+    # Only files that are read in full are read ahead (archive sources)
+    source.prefetch(relative_path for relative_path in (scan_store.relative_path(entry_id) for entry_id in wanted_ids)
+                    if reads_whole_file(source, relative_path, render_config))
+    for entry_id in wanted_ids:
+        relative_path = scan_store.relative_path(entry_id)
+        file_path = source.describe(relative_path)
+        file_text, raw_data, encoding = render_file_for_bundle(source, relative_path, render_config)
+        if encoding == ENCODING_SKIPPED:
+            skipped_files.append(relative_path.as_posix())
+            continue
+        manifest_entry: Optional[Dict[str, Any]] = None
+        chunk_records: Optional[List[str]] = None
+
+        for run in wanted[entry_id]:
+            runs_with_content.add(id(run))
+            config = run.config
+            output_buffer = run.writer
+            separator = config['separator'].format(filepath=relative_path.as_posix())
+            output_buffer.write(separator)
+
+            if config['add_bundle_index']:
+                run.bundle_index_entries.append(make_bundle_index_entry(
+                    relative_path.as_posix(), output_buffer.byte_offset, file_text, encoding))
+            output_buffer.write(file_text)
+            if config['orig_manifest_filename'] and raw_data is not None:
+                # Summaries return no raw bytes; those files are hashed when the manifest is written
                 try:
-                    # First try UTF-8, the most common encoding
-                    with open(file_path, 'r', encoding='utf-8') as infile:
-                        output_buffer.write(infile.read())
-                except UnicodeDecodeError:
-                    # If UTF-8 fails, try with replacement characters as a fallback
-                    print(f"Warning: Could not decode file as UTF-8: {file_path}. Trying with replacement.",
-                          file=sys.stderr)
+                    if manifest_entry is None:
+                        manifest_entry = make_manifest_entry(file_path, raw_data)
+                    run.manifest_entries[relative_path.as_posix()] = manifest_entry
+                except OSError as e:
+                    print(f"Warning: Could not add {file_path} to manifest: {e}", file=sys.stderr)
+            if config['orig_chunk_export_filename']:
+                if chunk_records is None:
+                    chunk_records = make_chunk_records(relative_path, file_text, encoding,
+                                                       render_config['chunk_max_lines'], chunk_cache)
+                if run.chunk_export is not None:
                     try:
-                        with open(file_path, 'r', encoding='utf-8', errors='replace') as infile:
-                            output_buffer.write(infile.read())
-                        output_buffer.write("\n[Warning: File contained non-UTF-8 characters replaced during read]\n")
-                    except Exception as e_inner:
-                        # If even replacement fails, log error and skip content
-                        print(f"Error: Failed to read file {file_path} even with replacement: {e_inner}",
+                        write_chunk_records(run.chunk_export, chunk_records)
+                        run.chunk_count += len(chunk_records)
+                    except OSError as e:
+                        print(f"Error: Could not write chunk export {config['orig_chunk_export_filename']}: {e}",
                               file=sys.stderr)
-                        output_buffer.write(
-                            f"[Error: Could not read file {relative_path.as_posix()} after decode error: {e_inner}]\n")
-                except FileNotFoundError:
-                    print(f"Warning: File not found during read (was listed but now missing?): {file_path}",
-                          file=sys.stderr)
-                    output_buffer.write(f"[Error: File not found at read time: {relative_path.as_posix()}]\n")
-                except OSError as e:
-                    print(f"Error: Could not read file {file_path}: {e}", file=sys.stderr)
-                    output_buffer.write(f"[Error: Could not read file {relative_path.as_posix()}: {e}]\n")
-                except Exception as e_generic:
-                    print(f"Error: Unexpected error reading file {file_path}: {e_generic}", file=sys.stderr)
-                    output_buffer.write(
-                        f"[Error: Unexpected error reading file {relative_path.as_posix()}: {e_generic}]\n")
-
-                # Ensure a newline after each file content
-                output_buffer.seek(0, io.SEEK_END)
-                if output_buffer.tell() > 0:
-                    output_buffer.seek(output_buffer.tell() - 1)
-                    last_char = output_buffer.read(1)
-                    if last_char != '\n':
-                        output_buffer.seek(0, io.SEEK_END)
-                        output_buffer.write('\n')
-                    else:
-                        output_buffer.seek(0, io.SEEK_END)
-
+                        run.chunk_export.close()
+                        run.chunk_export = None
+
+            # Ensure a newline after each file content
+            if not output_buffer.ends_with_newline():
+                output_buffer.write('\n')
+
+    if skipped_files:
+        print(f"Info: Skipped {len(skipped_files)} generated files (GENERATED_FILES = 'skip'): "
+              f"{', '.join(skipped_files[:10])}{', ...' if len(skipped_files) > 10 else ''}")
+
+    for run in bundle_runs:
+        if id(run) in runs_with_content:
+            continue
+        if run.delta_changes is not None:
+            run.writer.write("\n# --- No added or modified files since the delta base. ---\n")
         else:
             # No files included, add a note
-            output_buffer.write("\n# --- No files included in the bundle based on filters. ---\n")
+            run.writer.write("\n# --- No files included in the bundle based on filters. ---\n")
+
+
+def finish_bundle(run: ProfileRun, scan_store: ScanStore, root_dir_path: Path,
+                  script_dir: Path, generation_time_str: str):
+    """Mode 1 收尾: 追加捆绑包索引, 关闭分块导出, 并写入供下次增量运行使用的文件清单。"""
+    config = run.config
+    if config['output_mode'] != 1:
+        return
 
-    output_content = output_buffer.getvalue()
+    if config['add_bundle_index']:
+        write_bundle_index(run.writer, run.bundle_index_entries)
 
-    # 6. Determine Output Destination (File or Console) and Filename
+    if run.chunk_export is not None:
+        export_path = script_dir / config['orig_chunk_export_filename']
+        try:
+            run.chunk_export.close()
+            print(f"Chunk export written to: {export_path} ({run.chunk_count} chunks)")
+        except OSError as e:
+            print(f"Error: Could not write chunk export {export_path}: {e}", file=sys.stderr)
+        run.chunk_export = None
+
+    # Write the manifest for the next delta run (covers all included files, not only changed ones)
+    if config['orig_manifest_filename']:
+        for entry_id in run.included_ids:
+            relative_path = scan_store.relative_path(entry_id)
+            path_posix = relative_path.as_posix()
+            if path_posix in run.manifest_entries:
+                continue
+            try:
+                run.manifest_entries[path_posix] = make_manifest_entry(root_dir_path / relative_path)
+            except OSError as e:
+                print(f"Warning: Could not add {relative_path.as_posix()} to manifest: {e}", file=sys.stderr)
+        manifest_path = script_dir / config['orig_manifest_filename']
+        try:
+            write_bundle_manifest(manifest_path, root_dir_path, run.manifest_entries, generation_time_str)
+            print(f"Manifest written to: {manifest_path}")
+        except OSError as e:
+            print(f"Error: Could not write manifest {manifest_path}: {e}", file=sys.stderr)
+
+
+def open_output(run: ProfileRun, script_dir: Path, script_name: str):
+    """
+    确定输出目标 (文件或控制台) 和文件名, 并打开输出 (以及分块导出文件)。
+    内容在生成时直接写入文件; 控制台输出先写入临时文件, 由 finish_output() 在最后打印,
+    以免与进度信息混在一起。
+    """
+    config = run.config
+
+    # Determine Output Destination (File or Console) and Filename
     output_destination_config = config.get('orig_output_filename')  # Use original config value
     final_output_path = None  # Will be Path object if writing to file
 
@@ -859,10 +3200,15 @@ def main():
         if not ext:
             ext = ".txt"
 
+        # Outputs of several profiles are told apart by the profile name
+        base_name = profile_filename(base_name, config['profile_name'])
+
         output_mode = config['output_mode']
 
         # Construct filename based on mode
-        if output_mode == 1:
+        if output_mode == 1 and run.delta_changes is not None:
+            filename = f"{base_name}_delta_{timestamp}{ext}"
+        elif output_mode == 1:
             filename = f"{base_name}_{timestamp}{ext}"
         elif output_mode == 2:
             filename = f"{base_name}_filtered_structure_{timestamp}{ext}"
@@ -878,31 +3224,186 @@ def main():
                 file=sys.stderr)
             sys.exit(1)
 
-    # --- Write Output ---
+    # --- Open Output ---
+    # Keep '\n' untranslated when an index records byte offsets
+    newline = '' if config['add_bundle_index'] else None
+    stream: Optional[TextIO] = None
     if final_output_path:
         try:
-            with open(final_output_path, 'w', encoding='utf-8') as outfile:
-                outfile.write(output_content)
-            print(f"Output successfully written to: {final_output_path}")
+            stream = open(final_output_path, 'w', encoding='utf-8', newline=newline)
+            run.output_path = final_output_path
         except OSError as e:
             print(f"Error: Could not write to output file {final_output_path}: {e}", file=sys.stderr)
-            print("\n--- Output Content (due to write error) ---")
-            print(output_content)
-            print("--- End Output Content ---")
-        except Exception as e_generic_write:
-            print(f"Error: Unexpected error writing to output file {final_output_path}: {e_generic_write}",
+            print("The output will be printed to the console instead.")
+    if stream is None:
+        stream = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+    run.writer = BundleWriter(stream)
+
+    if config['orig_chunk_export_filename']:
+        export_path = script_dir / config['orig_chunk_export_filename']
+        try:
+            run.chunk_export = open(export_path, 'w', encoding='utf-8', newline='\n')
+        except OSError as e:
+            print(f"Error: Could not write chunk export {export_path}: {e}", file=sys.stderr)
+
+
+def finish_output(run: ProfileRun):
+    """关闭输出文件并报告结果; 控制台输出则从临时文件打印出来。"""
+    config = run.config
+    writer = run.writer
+    stream = writer.stream
+
+    if run.output_path:
+        try:
+            stream.close()
+        except OSError as e:
+            writer.error = writer.error or e
+        if writer.error is not None:
+            print(f"Error: Could not write to output file {run.output_path}: {writer.error}", file=sys.stderr)
+        else:
+            print(f"Output successfully written to: {run.output_path}")
+        return
+
+    title = f"Combined Output (stdout, profile '{config['profile_name']}')" if config['profile_name'] \
+        else "Combined Output (stdout)"
+    print(f"\n--- {title} ---")
+    try:
+        if writer.error is not None:
+            raise writer.error
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(1024 * 1024), ''):
+            sys.stdout.write(chunk)
+        if not writer.ends_with_newline():
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+    except Exception as e_stdout:
+        print(f"Error writing to stdout: {e_stdout}", file=sys.stderr)
+    finally:
+        stream.close()
+    print("--- End Output ---")
+
+
+# --- 主逻辑 ---
+
+def main():
+    """主执行函数。"""
+    # 0. Get script name and directory for hardcoded exclusion and header info
+    script_path = Path(__file__).resolve()
+    script_name = script_path.name
+    script_dir = script_path.parent
+
+    # 1. 解析和验证根目录
+    if not ROOT_DIR:
+        root_dir_path = script_dir
+    else:
+        root_dir_path = Path(ROOT_DIR).resolve()
+
+    try:
+        source = open_project_source(root_dir_path)
+    except (OSError,) + ARCHIVE_READ_ERRORS as e:
+        print(f"Error: Could not open archive {root_dir_path}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if source is None:
+        print(f"Error: Root directory not found or is not a directory (or .zip/.tar archive): {root_dir_path}",
+              file=sys.stderr)
+        sys.exit(1)
+
+    if source.is_archive:
+        print(f"Scanning project in archive: {root_dir_path}")
+    else:
+        print(f"Scanning project in: {root_dir_path}")
+    print(f"Script running from: {script_dir}")  # Inform user
+
+    # 1.A. (可选) 读取 .gitignore 文件 (规则会追加到每个输出配置的排除列表中)
+    # 使用 globals().get() 安全地检查 PROCESS_GITIGNORE 是否存在并为 True
+    gitignore_rules = read_gitignore_rules(source) if globals().get('PROCESS_GITIGNORE') else []
+
+    # 2. 准备每个输出配置的配置字典
+    profiles = resolve_output_profiles()
+    generated_filenames: Set[str] = set()
+    if source.is_archive:
+        if MANIFEST_FILENAME or DELTA_BASE or SCAN_CACHE_FILENAME:
+            # Manifests and deltas rely on file mtimes and git; archive listings need no cache
+            print("Info: MANIFEST_FILENAME, DELTA_BASE and SCAN_CACHE_FILENAME are ignored for archive sources.")
+    else:
+        if MANIFEST_FILENAME:
+            generated_filenames.update(profile_filename(Path(MANIFEST_FILENAME).name, p['name']) for p in profiles)
+        if SCAN_CACHE_FILENAME:
+            generated_filenames.add(Path(SCAN_CACHE_FILENAME).name)
+    if CHUNK_EXPORT_FILENAME:
+        generated_filenames.update(profile_filename(Path(CHUNK_EXPORT_FILENAME).name, p['name']) for p in profiles)
+    if CHUNK_CACHE_FILENAME:
+        generated_filenames.add(Path(CHUNK_CACHE_FILENAME).name)
+    configs = [build_config(profile, gitignore_rules, generated_filenames) for profile in profiles]
+    if source.is_archive:
+        for config in configs:
+            config['orig_manifest_filename'] = None
+            config['delta_base'] = ""
+    if len(configs) > 1:
+        print(f"Output profiles: {', '.join(config['profile_name'] for config in configs)}")
+
+    # 3. 遍历一次、为所有配置筛选文件 (结果保存在紧凑的 ScanStore 中, 只收集实际需要的部分)
+    scan_cache: Optional[ScanCache] = None
+    if SCAN_CACHE_FILENAME and not source.is_archive:
+        scan_cache_path = script_dir / Path(SCAN_CACHE_FILENAME).name
+        if sqlite3 is None:
+            print("Warning: SCAN_CACHE_FILENAME is set, but the sqlite3 module is not available. Scanning without cache.",
                   file=sys.stderr)
-    else:  # Output to console
-        print("\n--- Combined Output (stdout) ---")
-        if output_content and not output_content.endswith('\n'):
-            output_content += '\n'
+        else:
+            try:
+                scan_cache = ScanCache(scan_cache_path, root_dir_path)
+                source.scan_cache = scan_cache
+            except sqlite3.Error as e:
+                print(f"Warning: Could not open scan cache {scan_cache_path}: {e}. Scanning without cache.",
+                      file=sys.stderr)
+
+    print("Scanning files and directories...")
+    # Archive listings are read from memory, so only directories are scanned in parallel
+    scan_workers = 0 if source.is_archive else max(SCAN_WORKERS or 0, 0)
+    scan_store, total_scanned = scan_project(source, configs, script_name, workers=scan_workers)
+    if scan_cache is not None:
+        print(f"Scan cache: {scan_cache.hits} directories reused, {scan_cache.misses} re-listed.")
         try:
-            sys.stdout.write(output_content)
-            sys.stdout.flush()
-        except Exception as e_stdout:
-            print(f"Error writing to stdout: {e_stdout}", file=sys.stderr)
-        print("--- End Output ---")
+            scan_cache.save()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not update scan cache {scan_cache.cache_path}: {e}", file=sys.stderr)
+    print(f"Total items scanned (files/dirs after directory exclusion): {total_scanned}")
+
+    # 4. 排序每个配置被包含的文件 (for consistent output), 并计算增量
+    runs: List[ProfileRun] = []
+    for i, config in enumerate(configs):
+        bit = 1 << i
+        included_ids = array('l', scan_store.included_ids(bit) if config['output_mode'] in [1, 2] else [])
+        run = ProfileRun(config, bit, included_ids)
+        runs.append(run)
+        if config['output_mode'] in [1, 2]:
+            profile_note = f", profile '{config['profile_name']}'" if config['profile_name'] else ""
+            print(f"Found {len(included_ids)} files matching the inclusion criteria "
+                  f"(for Mode {config['output_mode']}{profile_note}).")
+        compute_profile_delta(run, scan_store, root_dir_path, script_dir, script_name)
+
+    # 5. 生成输出内容 (直接写入每个配置打开的输出): 头部和结构树, 然后是共享读取的文件内容
+    generation_time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S %Z")
+    for run in runs:
+        open_output(run, script_dir, script_name)
+        write_header_and_structure(run, scan_store, total_scanned, root_dir_path, script_dir, generation_time_str)
+    chunk_cache: Optional[ChunkCache] = None
+    if CHUNK_CACHE_FILENAME and any(config['orig_chunk_export_filename'] for config in configs):
+        chunk_cache = ChunkCache(script_dir / Path(CHUNK_CACHE_FILENAME).name, configs[0]['chunk_max_lines'])
+    write_file_contents(runs, scan_store, source, chunk_cache)
+    source.close()
+    if chunk_cache is not None:
+        print(f"Chunk cache: {chunk_cache.hits} files reused, {chunk_cache.misses} chunked.")
+        try:
+            chunk_cache.save()
+        except OSError as e:
+            print(f"Warning: Could not update chunk cache {chunk_cache.cache_path}: {e}", file=sys.stderr)
+
+    # 6. 收尾并写出每个配置的输出
+    for run in runs:
+        finish_bundle(run, scan_store, root_dir_path, script_dir, generation_time_str)
+        finish_output(run)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,127 @@
+"""bundle_project 中流式 JSON 解析与结构骨架的单元测试 (python -m unittest discover tests)。"""
+import io
+import json
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bundle_project as bp  # noqa: E402
+
+
+def events(text, chunk_size=7, **kwargs):
+    # Small reads put token boundaries everywhere
+    stream = io.StringIO(text)
+    read = stream.read
+    stream.read = lambda size=-1: read(min(size, chunk_size) if size > 0 else chunk_size)
+    return list(bp.iter_json_events(stream, **kwargs))
+
+
+def skeleton(text, max_items=3, max_keys=3, raw_skip=True):
+    skip_request = [None] if raw_skip else None
+    stream = io.StringIO(text)
+    return bp.build_json_skeleton(bp.iter_json_events(stream, skip_request=skip_request),
+                                  max_items, max_keys, skip_request)
+
+
+class IterJsonEventsTest(unittest.TestCase):
+    def test_valid_document(self):
+        result = events('{"a": [1, 2.5, {"b": null}], "c": "x\\"y", "d": true, "e": {}, "f": []}')
+        self.assertEqual(result, [
+            ('', 'start_map', None), ('', 'map_key', 'a'),
+            ('a', 'start_array', None), ('a.item', 'number', 1), ('a.item', 'number', 2.5),
+            ('a.item', 'start_map', None), ('a.item', 'map_key', 'b'), ('a.item.b', 'null', None),
+            ('a.item', 'end_map', None), ('a', 'end_array', None),
+            ('', 'map_key', 'c'), ('c', 'string', 'x"y'),
+            ('', 'map_key', 'd'), ('d', 'boolean', True),
+            ('', 'map_key', 'e'), ('e', 'start_map', None), ('e', 'end_map', None),
+            ('', 'map_key', 'f'), ('f', 'start_array', None), ('f', 'end_array', None),
+            ('', 'end_map', None),
+        ])
+
+    def test_scalar_document(self):
+        self.assertEqual(events(' 12345678901 '), [('', 'number', 12345678901)])
+
+    def test_invalid_documents(self):
+        for text in ('{"a" 1}', '[1 2 3]', '{"a":1,,,,}', '[1,]', '{"a":1,}', '[,1]', '{,}',
+                     '{"a":1 "b":2}', '{1: 2}', '[1:2]', '{"a"}', '[}', '{]', ']', ',', '[1] ]', 'nul'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                events(text)
+
+    def test_truncated_documents(self):
+        for text in ('{"a": [1, 2', '{"a": ', '{"a"', '[', '["abc', '', '   '):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                events(text)
+
+    def test_json_lines(self):
+        result = events('{"a": 1}\n{"a": 2}\n[3]\n')
+        self.assertEqual([event for event in result if event[1] in ('number', 'start_map', 'start_array')], [
+            ('', 'start_map', None), ('a', 'number', 1), ('', 'start_map', None), ('a', 'number', 2),
+            ('', 'start_array', None), ('item', 'number', 3),
+        ])
+
+    def test_skip_string(self):
+        result = events('{"keep": "abc", "drop": "' + 'x' * 100 + '"}', skip_string=lambda prefix: prefix == 'drop')
+        self.assertIn(('keep', 'string', 'abc'), result)
+        self.assertIn(('drop', 'skipped_string', 100), result)
+
+    def test_skip_rest_of_container(self):
+        skip_request = [None]
+        seen = []
+        for event in bp.iter_json_events(io.StringIO('[1, {"a": "]"}, [2, [3]], "x,y", 4] '), skip_request=skip_request):
+            seen.append(event)
+            if event == ('item', 'number', 1):
+                skip_request[0] = 'rest'
+        self.assertEqual(seen, [('', 'start_array', None), ('item', 'number', 1),
+                                ('', 'skipped_items', 4), ('', 'end_array', None)])
+
+    def test_skip_rest_reports_truncation(self):
+        skip_request = [None]
+        with self.assertRaises(ValueError):
+            for event in bp.iter_json_events(io.StringIO('[1, [2, 3'), skip_request=skip_request):
+                if event[1] == 'number':
+                    skip_request[0] = 'rest'
+
+
+class BuildJsonSkeletonTest(unittest.TestCase):
+    def test_truncates_arrays_and_objects(self):
+        text = json.dumps({"items": list(range(10)), "obj": {str(i): i for i in range(5)}, "s": "y" * 200})
+        for raw_skip in (True, False):
+            with self.subTest(raw_skip=raw_skip):
+                roots, count = skeleton(text, raw_skip=raw_skip)
+                self.assertEqual(count, 1)
+                self.assertEqual(roots[0]["items"], [0, 1, 2, "... (+7 more items)"])
+                self.assertEqual(roots[0]["obj"], {"0": 0, "1": 1, "2": 2, "...": "(+2 more keys)"})
+                self.assertTrue(roots[0]["s"].startswith("y" * bp.DATA_SUMMARY_MAX_STRING + "..."))
+
+    def test_omitted_nested_containers(self):
+        text = json.dumps([[1], {"a": [1, 2]}, "x", [[[]]], {"b": {"c": 1}}])
+        roots, _ = skeleton(text, max_items=2)
+        self.assertEqual(roots[0], [[1], {"a": [1, 2]}, "... (+3 more items)"])
+
+    def test_json_lines_root_is_capped(self):
+        text = "".join(json.dumps({"id": i, "tags": ["a", "b"]}) + "\n" for i in range(1000))
+        for raw_skip in (True, False):
+            with self.subTest(raw_skip=raw_skip):
+                roots, count = skeleton(text, raw_skip=raw_skip)
+                self.assertEqual(count, 1000)
+                self.assertEqual([root["id"] for root in roots], [0, 1, 2])
+
+    def test_json_lines_with_scalars(self):
+        roots, count = skeleton('1 "two" [3] {"four": 4} null')
+        self.assertEqual((roots, count), ([1, "two", [3]], 5))
+
+    def test_summary_reports_extra_records(self):
+        data = "".join(json.dumps({"id": i}) + "\n" for i in range(50)).encode()
+        summary = bp.summarize_json_file(io.BytesIO(data), len(data), {'data_summary_sample_items': 3})
+        self.assertIn("50 top-level values", summary)
+        self.assertIn("(+47 more records)", summary)
+
+    def test_invalid_input_raises(self):
+        with self.assertRaises(ValueError):
+            skeleton('[1, 2, 3, 4, 5')
+
+
+if __name__ == '__main__':
+    unittest.main()